@@ -2,173 +2,566 @@ import hist
 from hist.intervals import ratio_uncertainty
 import numpy as np
 
+from CutFinder.library import new_cut_state, set_current_bin, set_cut
+from CutFinder.profiling import stage
+
 # ! NB if scaling is applied, the cuts are computed on the offline pT scale.
 #! Inverse scaling will be applied in the regressor to map back to online pT.
 
 
-def iterative_bin_cutter(ref, obj, glob):
-    ref_h = ref.makeRate(glob.pt_bins, glob.maxRate)
+def _fraction_band(nEvents_ref, nScores, ref, obj):
+    # Poisson band on the fraction of events to keep
+    f_err = ratio_uncertainty(np.array([nEvents_ref]), np.array([nScores]), uncertainty_type="poisson-ratio") * (obj.TotEvents / ref.TotEvents)
+    return f_err[0][0], f_err[1][0]
+
+
+def _quantile_cut(scores, f, nEvents_ref, ref, obj):
+    # Cut keeping a fraction f of the scores, the error comes from the poisson band on f
+    f_err_down, f_err_up = _fraction_band(nEvents_ref, len(scores), ref, obj)
+
+    q = np.quantile(scores, 1 - f)
+    q_down = np.quantile(scores, 1 - min(f_err_up, 1.0))
+    q_up = np.quantile(scores, 1 - max(f_err_down, 0.0))
+    q_err = (q_up - q_down) / 2.0
+    return q, float(q_err)
+
+
+def max_score_per_bin(obj, pt_bins):
+    """
+    Per-event summary of obj, computed in NumPy on its pt/score columns.
+    Returns an array of shape (nEvents, len(pt_bins)) with the max score of the objects in each pt bin
+    (the last bin is open ended) and NaN where the bin is empty.
+    Events without objects above pt_bins[0] are dropped.
+    If obj has no columns they are extracted in a single event loop, with no expression compiled for the pt bins.
+    """
+    obj.bookColumns()
+    offsets = obj.columns["offsets"]
+    nEvents = len(offsets) - 1
+    nBins = len(pt_bins)
+    # highest bin with pt >= edge, like BinMaxScore
+    bin_idx = np.searchsorted(np.asarray(pt_bins, dtype=np.float64), np.asarray(obj.columns["pt"], dtype=np.float64), side="right") - 1
+    event_idx = np.repeat(np.arange(nEvents), np.diff(offsets))
+    inside = bin_idx >= 0
+    flat_idx = event_idx[inside] * nBins + bin_idx[inside]
+
+    summary = np.full(nEvents * nBins, -np.inf, dtype=np.float32)
+    np.maximum.at(summary, flat_idx, np.asarray(obj.columns["score"])[inside])
+    summary[np.bincount(flat_idx, minlength=nEvents * nBins) == 0] = np.nan
+    summary = summary.reshape(nEvents, nBins)
+    return summary[~np.all(np.isnan(summary), axis=1)]
+
+
+def max_score_entries(obj, pt_bins):
+    """
+    Sparse per-event summary of obj: the (event, max score) of every non-empty pt bin of every event, the same values
+    of max_score_per_bin, sorted by pt bin and score (ties by event).
+    Returns events, scores and the bounds of the pt bins (bin i in bounds[i]:bounds[i + 1]), computed with two sorts
+    in O(nObjects) memory whatever the number of pt bins.
+    """
+    obj.bookColumns()
+    offsets = obj.columns["offsets"]
+    nBins = len(pt_bins)
+    pt = np.asarray(obj.columns["pt"], dtype=np.float64)
+    bin_idx = np.searchsorted(np.asarray(pt_bins, dtype=np.float64), pt, side="right") - 1
+    event_idx = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    inside = bin_idx >= 0
+    key = event_idx[inside] * nBins + bin_idx[inside]
+    scores = np.asarray(obj.columns["score"])[inside].astype(np.float32)
+
+    # max score of every (event, bin), the last one sorted by score. A NaN score empties the bin, like max_score_per_bin
+    order = np.lexsort((scores, key))
+    key, scores = key[order], scores[order]
+    last = np.append(key[1:] != key[:-1], True)
+    last[last] = ~np.isnan(scores[last])
+    events, bins = np.divmod(key[last], nBins)
+    scores = scores[last]
+
+    # stable, the events of a bin with the same score stay in order
+    order = np.lexsort((scores, bins))
+    return events[order], scores[order], np.searchsorted(bins[order], np.arange(nBins + 1))
+
+
+def _cut_sequence(ref, obj, glob, ref_h, bin_scores, apply_cut):
+    """
+    Backwards cut-and-veto sequence: from the last pt bin to the first, find the cut keeping the target rate of the bin.
+    bin_scores(i) returns the max scores in pt bin i of the events not vetoed yet, apply_cut(i, cut) updates the veto
+    (-inf means no cut).
+    """
+    pt_bins = glob.pt_bins
     cuts = []
     cuts_err = []
-
     new_rate = []
 
-    print(f"Processing pt {len(glob.pt_bins)-1}: >= {glob.pt_bins[-1]} GeV (Obj: {obj.name}, Ref: {ref.name})")
-    if ref.rate[-1] == 0.0:
-        print(
-            f"Warning: target rate in {len(glob.pt_bins)-1} ({glob.pt_bins[-1]} GeV) is zero (probably due to low stat). No cut will be applied."
+    for i in range(len(pt_bins) - 1, -1, -1):
+        last = i == len(pt_bins) - 1
+        if last:
+            print(f"Processing pt {i}: >= {pt_bins[i]} GeV (Obj: {obj.name}, Ref: {ref.name})")
+        else:
+            print(f"Processing pt bin {i}: {pt_bins[i]} - {pt_bins[i + 1]} GeV (Obj: {obj.name}, Ref: {ref.name})")
+
+        with stage(f"algorithm bin {i}"):
+            scores = bin_scores(i)
+        prev_rate = new_rate[-1] if not last else 0.0
+        rate_bin = len(scores) * (glob.maxRate / obj.TotEvents) + prev_rate
+        target_rate = ref.rate[i] - (ref.rate[i + 1] if not last else 0.0)
+
+        if last and ref.rate[-1] == 0.0:
+            print(
+                f"Warning: target rate in {i} ({pt_bins[i]} GeV) is zero (probably due to low stat). No cut will be applied."
+            )
+            cuts.append(-np.inf)
+            cuts_err.append(0.0)
+        else:
+            nEvents_ref = ref_h[hist.loc(pt_bins[i])].value
+            f = target_rate / (rate_bin - prev_rate)
+            if f > 1.0:
+                print(
+                    f"Warning: target rate in bin {i} ({pt_bins[i]} GeV) is higher than current rate. No cut will be applied."
+                )
+                cuts.append(-np.inf)
+                cuts_err.append(0.0)
+            elif f < 0.0:
+                print(
+                    f"Warning: target rate in bin {i} ({pt_bins[i]} GeV) is lower than previous rate. No cut will be applied."
+                )
+                cuts.append(-np.inf)
+                cuts_err.append(0.0)
+            elif len(scores) == 0:
+                print(
+                    f"Warning: no events in the current pt bin {i} ({pt_bins[i]} GeV). No cut will be applied."
+                )
+                cuts.append(-np.inf)
+                cuts_err.append(0.0)
+            else:
+                q, q_err = _quantile_cut(scores, f, nEvents_ref, ref, obj)
+                cuts.append(q)
+                cuts_err.append(q_err)
+
+        new_rate.append(len(scores[scores >= np.nan_to_num(cuts[-1], neginf=-9999)]) * (glob.maxRate / obj.TotEvents) + prev_rate)
+        apply_cut(i, cuts[-1])
+
+        print(f"\tCut found : {cuts[-1]} +- {cuts_err[-1]}\n", flush=True)
+
+    cuts = np.array(cuts[::-1])
+    cuts_err = np.array(cuts_err[::-1])
+    new_rate = np.array(new_rate[::-1])
+    return cuts, cuts_err, new_rate
+
+
+def single_pass_cutter(summary, ref, obj, glob, ref_h):
+    """
+    Same backwards cut-and-veto sequence of iterative_bin_cutter, run in NumPy on the output of max_score_per_bin.
+    Gives the same cuts, cuts_err and new_rate of the RDF graph.
+    """
+    present = ~np.isnan(summary)
+    vetoed = np.zeros(len(summary), dtype=bool)
+
+    def bin_scores(i):
+        return summary[np.bitwise_and(~vetoed, present[:, i]), i]
+
+    def apply_cut(i, cut):
+        # Veto the lower bins like the RDF selection (BinSelected in include/functions.cpp): the objects passing
+        # a cut veto the event and hide the bins above, the objects of the bins without cut always veto the event.
+        # The threshold is parsed back from its string, like the literal baked in the old cut_mask
+        nonlocal vetoed
+        if cut != -np.inf:
+            vetoed = np.bitwise_and(present[:, i], summary[:, i].astype(np.float64) >= float(f"{cut}"))
+        else:
+            vetoed = np.bitwise_or(vetoed, present[:, i])
+
+    return _cut_sequence(ref, obj, glob, ref_h, bin_scores, apply_cut)
+
+
+def _weighted_quantile(sorted_scores, cum_weights, q):
+    """
+    np.quantile (linear method) of the sorted scores repeated by their integer weights, for many replicas at once.
+    cum_weights has shape (nReplicas, len(sorted_scores)), q has shape (nReplicas,)
+    """
+    total = cum_weights[:, -1]
+    h = (total - 1) * q
+    k0 = np.floor(h)
+    k1 = np.minimum(k0 + 1, total - 1)
+    # position in the sorted scores of the k-th element of the repeated array, a binary search in every row
+    nScores = cum_weights.shape[1]
+    j0 = np.array([np.searchsorted(row, k, side="right") for row, k in zip(cum_weights, k0)], dtype=np.int64)
+    j1 = np.array([np.searchsorted(row, k, side="right") for row, k in zip(cum_weights, k1)], dtype=np.int64)
+    j0 = np.minimum(j0, nScores - 1)
+    j1 = np.minimum(j1, nScores - 1)
+    return sorted_scores[j0] + (h - k0) * (sorted_scores[j1] - sorted_scores[j0])
+
+
+def _cumsum_rows(x):
+    """
+    Cumulative sum along the first axis in place, a row at a time: several times faster than np.cumsum(axis=0) on
+    wide rows
+    """
+    for k in range(1, len(x)):
+        np.add(x[k], x[k - 1], out=x[k])
+    return x
+
+
+def bootstrap_cuts_err(summary, ref, obj, glob, n_bootstrap=1000, seed=None, max_elements=50_000_000):
+    """
+    Bootstrap uncertainty of the cuts of single_pass_cutter.
+    Every replica resamples the events with Poisson(1) weights and runs the whole cut-and-veto sequence with its own
+    cuts and vetoes, all the replicas are processed together (in chunks of at most max_elements replicas x events).
+    The scores of each bin are sorted only once and only the events of the bin are processed: the veto of an event
+    follows from the first bin above it where it has objects and the last cut of the replica, so no veto state of
+    all the events is kept. Returns the standard deviation of the replica cuts in every bin.
+    """
+    rng = np.random.default_rng(seed)
+    pt_bins = glob.pt_bins
+    nBins = len(pt_bins)
+    norm = glob.maxRate / obj.TotEvents
+    present = ~np.isnan(summary)
+    chunk = max(1, min(n_bootstrap, max_elements // max(len(summary), 1)))
+
+    # events of every bin sorted by score, with the first bin above it where the event has objects (nBins if none)
+    # and its score there (NaN if none)
+    bins = []
+    next_bin = np.full(len(summary), nBins)
+    for i in range(nBins - 1, -1, -1):
+        in_bin = np.flatnonzero(present[:, i])
+        in_bin = in_bin[np.argsort(summary[in_bin, i], kind="stable")]
+        above = next_bin[in_bin]
+        score_above = np.where(above < nBins, summary[in_bin, np.minimum(above, nBins - 1)], np.nan)
+        bins.append((i, in_bin, summary[in_bin, i].astype(np.float64), above, score_above.astype(np.float64)))
+        next_bin[in_bin] = i
+
+    replica_cuts = np.full((n_bootstrap, nBins), np.nan)
+    for start in range(0, n_bootstrap, chunk):
+        nReplicas = min(chunk, n_bootstrap - start)
+        # events x replicas, so that the events of a bin are contiguous rows
+        weights = np.ascontiguousarray(rng.poisson(1.0, size=(nReplicas, len(summary))).astype(np.int32).T)
+        prev_rate = np.zeros(nReplicas)
+        # last bin with a cut of every replica (nBins if none) and its cut
+        cut_bin = np.full(nReplicas, nBins)
+        last_cut = np.full(nReplicas, np.inf)
+
+        for i, in_bin, sorted_scores, above, score_above in bins:
+            last = i == nBins - 1
+            # like single_pass_cutter: vetoed by the objects of the bins without cut below the last cut, or by the
+            # objects passing the last cut
+            vetoed = np.bitwise_or(
+                above[:, None] < cut_bin[None, :],
+                np.bitwise_and(above[:, None] == cut_bin[None, :], score_above[:, None] >= last_cut[None, :]),
+            )
+            cum_weights = _cumsum_rows(np.where(vetoed, 0, weights[in_bin]))
+            nScores = cum_weights[-1] if len(in_bin) > 0 else np.zeros(nReplicas, dtype=np.int32)
+            rate_bin = nScores * norm + prev_rate
+            target_rate = ref.rate[i] - (ref.rate[i + 1] if not last else 0.0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                f = target_rate / (rate_bin - prev_rate)
+
+            # same rules of the nominal sequence, -inf means no cut
+            cut = np.full(nReplicas, -np.inf)
+            apply = np.bitwise_and(np.bitwise_and(f <= 1.0, f >= 0.0), nScores > 0)
+            if last and ref.rate[-1] == 0.0:
+                apply[:] = False
+            if apply.any() and len(sorted_scores) > 0:
+                cut[apply] = _weighted_quantile(sorted_scores, cum_weights[:, apply].T, 1 - f[apply])
+            replica_cuts[start : start + nReplicas, i] = np.where(apply, cut, np.nan)
+
+            # the scores passing the cut are the ones from its position in the sorted scores
+            first = np.searchsorted(sorted_scores, np.nan_to_num(cut, neginf=-9999), side="left")
+            if len(in_bin) > 0:
+                failing = np.where(first > 0, cum_weights[np.maximum(first - 1, 0), np.arange(nReplicas)], 0)
+                prev_rate = (nScores - failing) * norm + prev_rate
+            cut_bin = np.where(apply, i, cut_bin)
+            last_cut = np.where(apply, cut, last_cut)
+
+    # bins where less than two replicas have a cut get no error
+    valid = np.sum(~np.isnan(replica_cuts), axis=0) > 1
+    cuts_err = np.zeros(nBins)
+    cuts_err[valid] = np.nanstd(replica_cuts[:, valid], axis=0, ddof=1)
+    return cuts_err
+
+
+def iterative_bin_cutter(ref, obj, glob, single_pass=False, n_bootstrap=0, seed=None):
+    ref_h = ref.makeRate(glob.pt_bins, glob.maxRate)
+    if single_pass or n_bootstrap > 0 or obj.columns is not None:
+        # Read the sample once (or use the cached columns) and run the whole cut-and-veto sequence in NumPy
+        summary = max_score_per_bin(obj, glob.pt_bins)
+        cuts, cuts_err, new_rate = single_pass_cutter(summary, ref, obj, glob, ref_h)
+        if n_bootstrap > 0:
+            print(f"Bootstrapping the cuts with {n_bootstrap} replicas (Obj: {obj.name}, Ref: {ref.name})")
+            cuts_err = np.where(cuts != -np.inf, bootstrap_cuts_err(summary, ref, obj, glob, n_bootstrap, seed), 0.0)
+        return cuts, cuts_err, new_rate
+
+    # Without columns (no cache, see streams): one event loop per pt bin on the same compiled selection, the cuts
+    # found so far are runtime data of the kernel
+    state = new_cut_state(len(glob.pt_bins))
+    edges = "{" + ", ".join(map(str, np.asarray(glob.pt_bins, dtype=float).tolist())) + "}"
+    rdf = (
+        obj.rdf.Define(
+            "bin_max_score",
+            f"BinMaxScore({obj.pt_branch}, {obj.score_branch}, {edges})",
         )
-        cuts.append(-np.inf)
-        cuts_err.append(0.0)
+        .Filter(f"BinSelected(bin_max_score, {state})")
+        .Define("max_score", f"CurrentBinScore(bin_max_score, {state})")
+    )
+
+    def bin_scores(i):
+        set_current_bin(state, i)
+        return rdf.AsNumpy(["max_score"])["max_score"]
+
+    def apply_cut(i, cut):
+        # the threshold parsed back from its string, like single_pass_cutter
+        set_cut(state, i, float(f"{cut}"))
+
+    return _cut_sequence(ref, obj, glob, ref_h, bin_scores, apply_cut)
+
+
+def _histogram_quantile(counts, edges, q):
+    """
+    np.quantile (linear method) of the histogrammed scores, every order statistic is replaced by the lower edge of
+    its score bin. counts has the underflow and overflow cells (len(edges) + 1 cells).
+    Returns the quantile and whether an order statistic falls in the underflow, where the lowest edge is used.
+    """
+    nEntries = counts.sum()
+    h = (nEntries - 1) * q
+    k0 = np.floor(h)
+    k1 = min(k0 + 1, nEntries - 1)
+    # cell of the k-th order statistic and its lower edge
+    cells = np.searchsorted(np.cumsum(counts), [k0, k1], side="right")
+    low_edges = edges[np.clip(cells - 1, 0, len(edges) - 1)]
+    return low_edges[0] + (h - k0) * (low_edges[1] - low_edges[0]), bool(np.any(cells == 0))
+
+
+def _histogram_quantile_cut(counts, edges, f, nEvents_ref, ref, obj):
+    # Same of _quantile_cut, with the quantiles read from the cumulative score histogram
+    f_err_down, f_err_up = _fraction_band(nEvents_ref, counts.sum(), ref, obj)
+
+    q, underflow = _histogram_quantile(counts, edges, 1 - f)
+    q_down, _ = _histogram_quantile(counts, edges, 1 - min(f_err_up, 1.0))
+    q_up, _ = _histogram_quantile(counts, edges, 1 - max(f_err_down, 0.0))
+    q_err = (q_up - q_down) / 2.0
+    return q, float(q_err), underflow
+
+
+def histogram_bin_cutter(ref, obj, glob, score_bins=(10000, 0.0, 1.0)):
+    """
+    Same cut-and-veto sequence of iterative_bin_cutter, with the scores of each pt bin booked in a score histogram
+    instead of being read in NumPy: the histograms are filled (and merged across the IMT threads) in the event loop,
+    the memory does not grow with the number of events and no sort is needed.
+    score_bins = (nbins, low, high) sets the resolution of the score histograms.
+    The quantiles are computed like iterative_bin_cutter with every score replaced by the lower edge of its score bin,
+    so each cut (and each edge of its error band) is at most one score bin width ((high - low) / nbins) below the
+    exact quantile of the events selected in its pt bin, for scores inside [low, high). The lower cuts move the veto
+    of the events with a score between the two, so with few events the cuts of the bins below can differ by more.
+    Scores outside the range are counted in the flow bins and take the nearest range edge, with a warning if a cut
+    falls in the underflow.
+    If obj has columns (e.g. from the cache) the histograms are filled in NumPy without any event loop.
+    Every pt bin still needs its own event loop, as the veto depends on the cuts of the higher bins.
+    """
+    from CutFinder.configs import _histo_contents
+
+    ref_h = ref.makeRate(glob.pt_bins, glob.maxRate)
+    pt_bins = glob.pt_bins
+    nbins, low, high = score_bins
+    edges = np.linspace(low, high, nbins + 1)
+
+    if obj.columns is not None:
+        summary = max_score_per_bin(obj, pt_bins)
+        present = ~np.isnan(summary)
+        vetoed = np.zeros(len(summary), dtype=bool)
     else:
-        # Select max score in the last pt bin
-        scores = (
+        summary = None
+        # same compiled selection of iterative_bin_cutter
+        state = new_cut_state(len(pt_bins))
+        pt_edges = "{" + ", ".join(map(str, np.asarray(pt_bins, dtype=float).tolist())) + "}"
+        rdf = (
             obj.rdf.Define(
-                "scores", f"{obj.score_branch}[{obj.pt_branch} >= {glob.pt_bins[-1]}]"
+                "bin_max_score",
+                f"BinMaxScore({obj.pt_branch}, {obj.score_branch}, {pt_edges})",
             )
-            .Filter("scores.size() > 0")
-            .Define("max_score", "Max(scores)")
-        ).AsNumpy(["max_score"])["max_score"]
+            .Filter(f"BinSelected(bin_max_score, {state})")
+            .Define("max_score", f"CurrentBinScore(bin_max_score, {state})")
+        )
+
+    cuts = []
+    cuts_err = []
+    new_rate = []
 
-        rate_bin = len(scores) * (glob.maxRate / obj.TotEvents)
+    for i in range(len(pt_bins) - 1, -1, -1):
+        last = i == len(pt_bins) - 1
+        if last:
+            print(f"Processing pt {i}: >= {pt_bins[i]} GeV (Obj: {obj.name}, Ref: {ref.name})")
+        else:
+            print(f"Processing pt bin {i}: {pt_bins[i]} - {pt_bins[i + 1]} GeV (Obj: {obj.name}, Ref: {ref.name})")
 
-        nEvents_ref = ref_h[hist.loc(glob.pt_bins[-1])].value
+        with stage(f"algorithm bin {i}"):
+            if summary is not None:
+                scores = summary[np.bitwise_and(~vetoed, present[:, i]), i]
+                counts = np.bincount(np.searchsorted(edges, scores, side="right"), minlength=nbins + 2).astype(np.float64)
+            else:
+                set_current_bin(state, i)
+                counts = _histo_contents(rdf.Histo1D(("", "", nbins, low, high), "max_score").GetValue())
 
-        # Fraction of events to keep in the last pt bin
-        f = ref.rate[-1] / rate_bin
+        nScores = counts.sum()
+        prev_rate = new_rate[-1] if not last else 0.0
+        rate_bin = nScores * (glob.maxRate / obj.TotEvents) + prev_rate
+        target_rate = ref.rate[i] - (ref.rate[i + 1] if not last else 0.0)
 
-        # check if f>=1 otherwise no cut can be applied
-        if f > 1.0:
+        if last and ref.rate[-1] == 0.0:
             print(
-                f"Warning: target rate in bin {len(glob.pt_bins)-1} ({glob.pt_bins[-1]} GeV) is higher than current rate. No cut will be applied."
+                f"Warning: target rate in {i} ({pt_bins[i]} GeV) is zero (probably due to low stat). No cut will be applied."
             )
             cuts.append(-np.inf)
             cuts_err.append(0.0)
-        elif len(scores) == 0:
+        elif nScores == 0:
             print(
-                f"Warning: no events in the last pt bin {glob.pt_bins[-1]} GeV. No cut will be applied."
+                f"Warning: no events in the current pt bin {i} ({pt_bins[i]} GeV). No cut will be applied."
             )
             cuts.append(-np.inf)
             cuts_err.append(0.0)
         else:
-            f_err = ratio_uncertainty(np.array([nEvents_ref]), np.array([len(scores)]), uncertainty_type="poisson-ratio") * (obj.TotEvents / ref.TotEvents)
-            f_err_up = f_err[1][0]
-            f_err_down = f_err[0][0]
+            nEvents_ref = ref_h[hist.loc(pt_bins[i])].value
+            f = target_rate / (rate_bin - prev_rate)
+            if f > 1.0:
+                print(
+                    f"Warning: target rate in bin {i} ({pt_bins[i]} GeV) is higher than current rate. No cut will be applied."
+                )
+                cuts.append(-np.inf)
+                cuts_err.append(0.0)
+            elif f < 0.0:
+                print(
+                    f"Warning: target rate in bin {i} ({pt_bins[i]} GeV) is lower than previous rate. No cut will be applied."
+                )
+                cuts.append(-np.inf)
+                cuts_err.append(0.0)
+            else:
+                q, q_err, underflow = _histogram_quantile_cut(counts, edges, f, nEvents_ref, ref, obj)
+                if underflow:
+                    print(
+                        f"Warning: the cut in bin {i} ({pt_bins[i]} GeV) is below the score histogram range. Clamped to {low}."
+                    )
+                cuts.append(q)
+                cuts_err.append(q_err)
 
-            q = np.quantile(scores, 1 - f)
-            q_down = np.quantile(scores, 1 - min(f_err_up, 1.0))
-            q_up = np.quantile(scores, 1 - max(f_err_down, 0.0))
+        # entries >= cut
+        kept = counts[np.searchsorted(edges, cuts[-1], side="right"):].sum() if cuts[-1] != -np.inf else nScores
+        new_rate.append(kept * (glob.maxRate / obj.TotEvents) + prev_rate)
 
-            q_err = (q_up - q_down) / 2.0
+        # Veto the lower bins like single_pass_cutter
+        if summary is None:
+            set_cut(state, i, cuts[-1])
+        elif cuts[-1] != -np.inf:
+            vetoed = np.bitwise_and(present[:, i], summary[:, i].astype(np.float64) >= float(f"{cuts[-1]}"))
+        else:
+            vetoed = np.bitwise_or(vetoed, present[:, i])
 
-            cuts.append(q)
-            cuts_err.append(float(q_err))
+        print(f"\tCut found : {cuts[-1]} +- {cuts_err[-1]}\n", flush=True)
 
-        new_rate.append(len(scores[scores >= np.nan_to_num(cuts[-1], neginf = -9999)]) * (glob.maxRate / obj.TotEvents))
+    cuts = np.array(cuts[::-1])
+    cuts_err = np.array(cuts_err[::-1])
+    new_rate = np.array(new_rate[::-1])
+    return cuts, cuts_err, new_rate
 
-        print(f"\tCut found : {cuts[-1]} +- {cuts_err[-1]}\n", flush=True)
 
-    # Apply cut in the last bin
-    if cuts[-1] != -np.inf:
-        cut_mask = f"({obj.pt_branch} >= {glob.pt_bins[-1]} && {obj.score_branch} >= {cuts[-1]}) || ({obj.pt_branch} < {glob.pt_bins[-1]})"
-        rdf = (
-            obj.rdf.Define("cut_mask", cut_mask)
-            .Redefine(
-                obj.score_branch,
-                f"{obj.score_branch}[cut_mask]",
-            )
-            .Redefine(
-                obj.pt_branch,
-                f"{obj.pt_branch}[cut_mask]",
-            )
-            .Filter(f"{obj.pt_branch}.size() > 0")
-        )
-    else:
-        rdf = obj.rdf.Define(
-            "cut_mask", f"ROOT::VecOps::RVec<bool>({obj.pt_branch}.size(), true)"
-        )  # keep all events
+def _count_cut(scores, candidates, k):
+    """
+    Cut keeping the k highest scores among the candidates, found with a binary search.
+    scores are sorted ascendingly, candidates[j] is the number of candidates among the j highest scores.
+    With k = 0 the cut is just above the highest candidate (in float32, like WP_mask).
+    """
+    k = int(np.clip(round(k), 0, candidates[-1]))
+    if k == 0:
+        top = scores[len(scores) - np.searchsorted(candidates, 1)]
+        return float(np.nextafter(np.float32(top), np.float32(np.inf)))
+    return float(scores[len(scores) - np.searchsorted(candidates, k)])
 
-    for i in range(len(glob.pt_bins) - 2, -1, -1):
-        print(
-            f"Processing pt bin {i}: {glob.pt_bins[i]} - {glob.pt_bins[i + 1]} GeV (Obj: {obj.name}, Ref: {ref.name})"
-        )
-        # Select max score in the current pt bin (from the last to the first) and discard events which already triggered the previous cuts
-        scores = (
-            # Discard events which already triggered previous cuts
-            rdf.Filter(f"Max({obj.pt_branch}) < {glob.pt_bins[i + 1]}")
-            # select objs in current pt bin
-            .Redefine(
-                obj.score_branch,
-                f"{obj.score_branch}[{obj.pt_branch} >= {glob.pt_bins[i]} && {obj.pt_branch} < {glob.pt_bins[i + 1]}]",
-            )
-            .Redefine(
-                obj.pt_branch,
-                f"{obj.pt_branch}[{obj.pt_branch} >= {glob.pt_bins[i]} && {obj.pt_branch} < {glob.pt_bins[i + 1]}]",
-            )
-            .Filter(f"{obj.pt_branch}.size() > 0")
-            # Select max score
-            .Define("max_score", f"Max({obj.score_branch})")
-            .AsNumpy(["max_score"])["max_score"]
-        )
 
-        rate_bin = len(scores) * (glob.maxRate / obj.TotEvents) + new_rate[-1]
-        nEvents_ref = ref_h[hist.loc(glob.pt_bins[i])].value
+def sorted_threshold_cutter(ref, obj, glob):
+    """
+    Global threshold solver on the sparse per-event summary of max_score_entries (the max score in every non-empty
+    pt bin of every event). The events of all the pt bins are sorted by bin and score only once. Going down from the last bin, every event fires in the
+    highest bin where it passes the cut (every event passes in the bins without cut) and is not a candidate in the
+    bins below. The cut of each bin keeps the candidates needed for the obj rate to match the cumulative ref.rate[i]
+    directly (not the rate difference of the bin), so the deviations of the higher bins are absorbed by the lower ones.
+    Each cut is a binary search on the prefix sums of the candidates, O(log N), the bookkeeping of the fired events is
+    linear in the events of the bin and the memory in the number of objects, so very fine binnings are cheap.
+    The cuts are not the ones of iterative_bin_cutter, whose selection vetoes the events on the last cut only.
+    The errors come from the same poisson band on the fraction of events to keep.
+    """
+    ref_h = ref.makeRate(glob.pt_bins, glob.maxRate)
+    pt_bins = glob.pt_bins
+    entry_events, entry_scores, bounds = max_score_entries(obj, pt_bins)
+    norm = glob.maxRate / obj.TotEvents
+    # bin in which every event fires, -1 if not yet
+    fired_bin = np.full(len(obj.columns["offsets"]) - 1, -1, dtype=np.int64)
+    nFired = 0
 
-        f = (ref.rate[i] - ref.rate[i + 1]) / (rate_bin - new_rate[-1])
-        if f > 1.0:
+    cuts = []
+    cuts_err = []
+    new_rate = []
+    for i in range(len(pt_bins) - 1, -1, -1):
+        last = i == len(pt_bins) - 1
+        if last:
+            print(f"Processing pt {i}: >= {pt_bins[i]} GeV (Obj: {obj.name}, Ref: {ref.name})")
+        else:
+            print(f"Processing pt bin {i}: {pt_bins[i]} - {pt_bins[i + 1]} GeV (Obj: {obj.name}, Ref: {ref.name})")
+
+        with stage(f"algorithm bin {i}"):
+            events = entry_events[bounds[i] : bounds[i + 1]]
+            scores = entry_scores[bounds[i] : bounds[i + 1]].astype(np.float64)
+            candidates = np.concatenate([[0], np.cumsum(fired_bin[events][::-1] < 0)])
+        nCandidates = candidates[-1]
+        # events that have to fire in this bin
+        target = ref.rate[i] / norm - nFired
+
+        if last and ref.rate[-1] == 0.0:
+            print(
+                f"Warning: target rate in {i} ({pt_bins[i]} GeV) is zero (probably due to low stat). No cut will be applied."
+            )
+            cuts.append(-np.inf)
+            cuts_err.append(0.0)
+        elif nCandidates == 0:
             print(
-                f"Warning: target rate in bin {i} ({glob.pt_bins[i]} GeV) is higher than current rate. No cut will be applied."
+                f"Warning: no events in the current pt bin {i} ({pt_bins[i]} GeV). No cut will be applied."
             )
             cuts.append(-np.inf)
             cuts_err.append(0.0)
-        elif f < 0.0:
+        elif target >= nCandidates:
             print(
-                f"Warning: target rate in bin {i} ({glob.pt_bins[i]} GeV) is lower than previous rate. No cut will be applied."
+                f"Warning: target rate in bin {i} ({pt_bins[i]} GeV) is higher than current rate. No cut will be applied."
             )
             cuts.append(-np.inf)
             cuts_err.append(0.0)
         else:
-            # find cut to achieve target rate in the current pt bin
-            if len(scores) == 0:
+            if target < 0.0:
                 print(
-                    f"Warning: no events in the current pt bin {i} ({glob.pt_bins[i]} GeV). No cut will be applied."
+                    f"Warning: rate of the bins above {pt_bins[i]} GeV already higher than the target. The cut keeps no event."
                 )
-                cuts.append(-np.inf)
-                cuts_err.append(0.0)
-            else:
-                f_err = ratio_uncertainty(np.array([nEvents_ref]), np.array([len(scores)]), uncertainty_type="poisson-ratio") * (obj.TotEvents / ref.TotEvents)
-                f_err_up = f_err[1][0]
-                f_err_down = f_err[0][0]
+            nEvents_ref = ref_h[hist.loc(pt_bins[i])].value
+            f_err_down, f_err_up = _fraction_band(nEvents_ref, nCandidates, ref, obj)
+            cut_down = _count_cut(scores, candidates, min(f_err_up, 1.0) * nCandidates)
+            cut_up = _count_cut(scores, candidates, max(f_err_down, 0.0) * nCandidates)
+            cuts.append(_count_cut(scores, candidates, target))
+            cuts_err.append((cut_up - cut_down) / 2.0)
 
-                q = np.quantile(scores, 1 - f)
-                q_down = np.quantile(scores, 1 - min(f_err_up, 1.0))
-                q_up = np.quantile(scores, 1 - max(f_err_down, 0.0))
-                q_err = (q_up - q_down) / 2.0
+        passing = events[scores >= cuts[-1]]
+        passing = passing[fired_bin[passing] < 0]
+        fired_bin[passing] = i
+        nFired += len(passing)
+        new_rate.append(nFired * norm)
 
-                cuts.append(q)
-                cuts_err.append(float(q_err))
-
-        new_rate.append(len(scores[scores >= np.nan_to_num(cuts[-1], neginf = -9999)]) * (glob.maxRate / obj.TotEvents) + new_rate[-1])
-
-        if (
-            cuts[-1] != -np.inf and i > 0
-        ):  # it's useless to apply cut in the first bin (last iteration)
-            cut_mask = f"({obj.pt_branch} >= {glob.pt_bins[i]} && {obj.pt_branch} < {glob.pt_bins[i + 1]} && {obj.score_branch} >= {cuts[-1]}) || ({obj.pt_branch} < {glob.pt_bins[i]})"
-            rdf = (
-                rdf.Redefine("cut_mask", cut_mask)
-                .Redefine(
-                    obj.score_branch,
-                    f"{obj.score_branch}[cut_mask]",
-                )
-                .Redefine(
-                    obj.pt_branch,
-                    f"{obj.pt_branch}[cut_mask]",
-                )
-                .Filter(f"{obj.pt_branch}.size() > 0")
-            )
         print(f"\tCut found : {cuts[-1]} +- {cuts_err[-1]}\n", flush=True)
 
     cuts = np.array(cuts[::-1])
     cuts_err = np.array(cuts_err[::-1])
     new_rate = np.array(new_rate[::-1])
     return cuts, cuts_err, new_rate
+
+
+def streams(glob):
+    """
+    Whether glob.algo reads obj in its own RDF event loops, without the pt/score columns: histogram_bin_cutter and
+    iterative_bin_cutter without single_pass and n_bootstrap. The columns of obj are extracted (and cached or sharded)
+    for the other algorithms only, see CutFinder.pipeline.compute_configs.
+    """
+    if glob.algo is histogram_bin_cutter:
+        return True
+    if glob.algo is iterative_bin_cutter:
+        return not glob.algo_kwargs.get("single_pass", False) and glob.algo_kwargs.get("n_bootstrap", 0) == 0
+    return False
@@ -0,0 +1,203 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+#! The cache stores the jagged pt/score arrays of a Config after preprocess, WP and scaling
+#! as flat offsets + values .npy files, loaded back memory-mapped. Configs store one entry per file.
+#! The ResultStore keeps the full (bin-by-bin) cuts of every (ref, obj) pair, keyed by everything they depend on.
+
+COLUMNS = ("offsets", "pt", "score")
+
+
+def function_source(func):
+    # Source code of a (partial) preprocess function, used to detect changes in the preprocessing
+    if func is None:
+        return None
+    if isinstance(func, functools.partial):
+        return [function_source(func.func), repr(func.args), repr(sorted(func.keywords.items()))]
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return repr(func)
+
+
+def hash_identity(identity):
+    return hashlib.sha256(
+        json.dumps(identity, sort_keys=True, default=str).encode()
+    ).hexdigest()[:32]
+
+
+class ColumnCache:
+    def __init__(self, path, max_size=50.0):
+        # max_size in GB, None to never evict (e.g. the partials of the shards)
+        self.path = os.path.expanduser(path)
+        self.max_size = None if max_size is None else int(max_size * 1024**3)
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, config, file=None):
+        # key of the columns of a single file of config, or of the whole sample
+        return hash_identity(config.identity() if file is None else config.fileIdentity(file))
+
+    def contains(self, key):
+        return os.path.exists(os.path.join(self.path, key, "meta.json"))
+
+    def load(self, key):
+        entry = os.path.join(self.path, key)
+        if not os.path.exists(os.path.join(entry, "meta.json")):
+            return None
+        with open(os.path.join(entry, "meta.json"), "r") as fp:
+            meta = json.load(fp)
+        columns = {}
+        for column in COLUMNS:
+            file = os.path.join(entry, f"{column}.npy")
+            if os.path.exists(file):
+                columns[column] = np.load(file, mmap_mode="r")
+        # LRU bookkeeping
+        os.utime(os.path.join(entry, "meta.json"))
+        return columns, meta
+
+    def store(self, key, columns, meta, evict=True):
+        # With evict=False the caller evicts once after a batch of stores, see Config.columns
+        entry = os.path.join(self.path, key)
+        tmp = f"{entry}.tmp{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        size = 0
+        for column, values in columns.items():
+            if values is not None:
+                np.save(os.path.join(tmp, f"{column}.npy"), values)
+                size += os.path.getsize(os.path.join(tmp, f"{column}.npy"))
+        with open(os.path.join(tmp, "meta.json"), "w") as fp:
+            json.dump({**meta, "size": size}, fp, indent=4)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.replace(tmp, entry)
+        except OSError:
+            # another process stored the same entry in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+        if evict:
+            self.evict(keep={key})
+
+    def entries(self):
+        # (last use, size, key), the size is read from meta.json (the entries of older versions are scanned)
+        entries = []
+        for key in os.listdir(self.path):
+            meta = os.path.join(self.path, key, "meta.json")
+            try:
+                with open(meta, "r") as fp:
+                    size = json.load(fp).get("size")
+                mtime = os.path.getmtime(meta)
+            except (OSError, ValueError):
+                continue
+            if size is None:
+                size = sum(f.stat().st_size for f in os.scandir(os.path.join(self.path, key)))
+            entries.append((mtime, size, key))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=()):
+        # Remove the least recently used entries, but the ones in keep, until the cache fits in max_size
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key in keep:
+                continue
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        # only the entries, the folder also holds the compiled library and the staged files
+        for _, _, key in self.entries():
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+
+
+class ResultStore:
+    """
+    Full cuts, errors and rates of the (ref, obj) pairs, one JSON file per pair in path.
+    The key is the hash of the identity of both configs (files, preprocess, WP, scaling), pt_bins, maxRate, algo,
+    algo_kwargs and the code of the rates (CutFinder.configs, applyWP and include/functions.cpp): unchanged pairs are
+    never computed again and a run stopped halfway resumes from the stored pairs.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, ref, obj, glob):
+        return hash_identity(
+            {
+                "ref": _result_identity(ref),
+                "obj": _result_identity(obj),
+                "pt_bins": np.asarray(glob.pt_bins, dtype=float).tolist(),
+                "maxRate": glob.maxRate,
+                "algo": _algo_source(glob.algo),
+                "algo_kwargs": glob.algo_kwargs,
+                "rate": _rate_source(),
+            }
+        )
+
+    def load(self, ref, obj, glob):
+        file = os.path.join(self.path, f"{self.key(ref, obj, glob)}.json")
+        if not os.path.exists(file):
+            return None
+        with open(file, "r") as fp:
+            result = json.load(fp)
+        return {name: np.array(values) for name, values in result.items()}
+
+    def store(self, ref, obj, glob, cuts, cuts_err, rate, ref_rate):
+        file = os.path.join(self.path, f"{self.key(ref, obj, glob)}.json")
+        result = {"cuts": cuts, "cuts_err": cuts_err, "rate": rate, "ref_rate": ref_rate}
+        tmp = f"{file}.tmp{os.getpid()}"
+        with open(tmp, "w") as fp:
+            json.dump({name: np.asarray(values, dtype=float).tolist() for name, values in result.items()}, fp)
+        os.replace(tmp, file)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+
+def _result_identity(config):
+    # A rate given by the user replaces the sample, see Config.makeRate
+    if config.samples_path is None:
+        return {"rate": np.asarray(config.rate, dtype=float).tolist()}
+    identity = config.identity()
+    if config.rate is not None and not config.rateHists:
+        identity["rate"] = np.asarray(config.rate, dtype=float).tolist()
+    return identity
+
+
+def _algo_source(algo):
+    # The algorithms of CutFinder also depend on the helpers of their module
+    source = function_source(algo)
+    module = getattr(algo, "__module__", None) or ""
+    if module.startswith("CutFinder.") and module in sys.modules:
+        source = [source, function_source(sys.modules[module])]
+    return source
+
+
+@functools.cache
+def _rate_source():
+    # The rates and the selections come from the configs module, applyWP and the C++ helpers, fixed during a run
+    from CutFinder import configs, functions, library
+
+    with open(library.SOURCE, "rb") as fp:
+        helpers = hashlib.sha256(fp.read()).hexdigest()
+    return [function_source(configs), function_source(functions), helpers]
+
+
+def default_cache_path():
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "CutFinder"
+    )
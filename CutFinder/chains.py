@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import itertools
+import json
+import math
+import os
+import re
+
+import ROOT
+
+from CutFinder.cache import default_cache_path
+
+#! Expansion of samples_path in the list of files of a chain and number of entries of each file read from the file
+#! metadata (the tree header), cached on disk by (path, tree, mtime, size): the total number of events of a sample
+#! is known without any event loop.
+
+_BRACE = re.compile(r"\{([^{}]*)\}")
+
+
+def expand_braces(path):
+    # Every {a..b} range and {x,y,z} alternative, in order
+    match = _BRACE.search(path)
+    if match is None:
+        return [path]
+    content = match.group(1)
+    if ".." in content:
+        start, end = content.split("..")
+        width = len(start) if start.startswith("0") else 0
+        values = [str(i).zfill(width) for i in range(int(start), int(end) + 1)]
+    else:
+        values = content.split(",")
+    head, tail = path[: match.start()], path[match.end() :]
+    return list(itertools.chain.from_iterable(expand_braces(head + value + tail) for value in values))
+
+
+def expand_path(samples_path):
+    """
+    Files of samples_path, which can be a path or a list of paths with braces ({a..b} ranges and {x,y} alternatives)
+    and wildcards, or a .txt file (or @file) listing one path per line.
+    Local wildcards are expanded with glob, remote ones by TChain.Add.
+    """
+    if isinstance(samples_path, (list, tuple)):
+        return list(itertools.chain.from_iterable(expand_path(path) for path in samples_path))
+
+    if samples_path.startswith("@") or samples_path.endswith(".txt"):
+        with open(samples_path.lstrip("@"), "r") as fp:
+            lines = [line.strip() for line in fp]
+        return expand_path([line for line in lines if line and not line.startswith("#")])
+
+    files = []
+    for path in expand_braces(samples_path):
+        if not any(wildcard in path for wildcard in "*?["):
+            files.append(path)
+        elif "://" not in path or path.startswith("file://"):
+            files.extend(sorted(glob.glob(path.removeprefix("file://"))))
+        else:
+            chain = ROOT.TChain()
+            chain.Add(path)
+            files.extend(element.GetTitle() for element in chain.GetListOfFiles())
+    return files
+
+
+def file_stat(file):
+    stat = ROOT.FileStat_t()
+    if ROOT.gSystem.GetPathInfo(file, stat) == 0:
+        return stat.fMtime, stat.fSize
+    return None, None
+
+
+def file_stats(files, workers=16):
+    # file_stat of every file with a thread pool, like count_entries
+    ROOT.EnableThreadSafety()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(file_stat, files))
+
+
+def file_entries(file, tree):
+    # Entries in the tree header, no event is read
+    tfile = ROOT.TFile.Open(file)
+    if not tfile or tfile.IsZombie():
+        raise OSError(f"Cannot open {file}")
+    ttree = tfile.Get(tree)
+    entries = ttree.GetEntries() if ttree else 0
+    tfile.Close()
+    return entries
+
+
+# the files are opened by the threads of count_entries and file_stats
+for _function in (ROOT.TFile.Open, ROOT.gSystem.GetPathInfo):
+    try:
+        _function.__release_gil__ = True
+    except AttributeError:
+        pass
+
+
+class EntriesCache:
+    # (path, tree, mtime, size) -> entries, in a JSON file
+    def __init__(self, path=None):
+        self.path = os.path.expanduser(path or os.path.join(default_cache_path(), "entries.json"))
+        self.entries = dict()
+        if os.path.exists(self.path):
+            with open(self.path, "r") as fp:
+                self.entries = json.load(fp)
+
+    def key(self, file, tree, mtime, size):
+        return json.dumps([file, tree, mtime, size])
+
+    def get(self, file, tree, mtime, size):
+        if mtime is None:
+            return None
+        return self.entries.get(self.key(file, tree, mtime, size))
+
+    def set(self, file, tree, mtime, size, entries):
+        if mtime is not None:
+            self.entries[self.key(file, tree, mtime, size)] = entries
+
+    def save(self):
+        # merge with the entries saved in the meantime by other processes
+        if os.path.exists(self.path):
+            with open(self.path, "r") as fp:
+                self.entries = {**json.load(fp), **self.entries}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp, "w") as fp:
+            json.dump(self.entries, fp)
+        os.replace(tmp, self.path)
+
+
+def count_entries(files, tree, workers=16, cache=None):
+    """
+    Number of entries of the tree in each file, read from the metadata with a thread pool.
+    The counts of the files whose modification time and size did not change are taken from the EntriesCache.
+    """
+    ROOT.EnableThreadSafety()
+    cache = EntriesCache() if cache is None else cache
+
+    def entries(file):
+        mtime, size = file_stat(file)
+        cached = cache.get(file, tree, mtime, size)
+        if cached is not None:
+            return cached, None
+        return file_entries(file, tree), (mtime, size)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(entries, files))
+
+    for file, (nEntries, stat) in zip(files, results):
+        if stat is not None:
+            cache.set(file, tree, *stat, nEntries)
+    if any(stat is not None for _, stat in results):
+        cache.save()
+    return [nEntries for nEntries, _ in results]
+
+
+def preview_subset(files, entries, fraction=None, max_events=None):
+    """
+    Deterministic subset of the files of a sample for a preview: every round(1 / fraction)-th file for a fraction of
+    the events, the files in order for max_events (the other files follow if the first ones are not enough).
+    Returns the files, their entries and the number of entries to read, which can end in the middle of the last file.
+    The files stay in the order they are chosen, so that the limit cuts the file chosen last.
+    """
+    target = sum(entries)
+    stride = 1
+    if fraction is not None:
+        target = math.ceil(fraction * target)
+        stride = max(1, round(1 / fraction))
+    if max_events is not None:
+        target = min(target, max_events)
+
+    order = list(range(0, len(files), stride)) + [i for i in range(len(files)) if i % stride != 0]
+    subset = []
+    total = 0
+    for i in order:
+        if total >= target:
+            break
+        subset.append(i)
+        total += entries[i]
+    return [files[i] for i in subset], [entries[i] for i in subset], min(total, target)
+
+
+def shard_files(files, index, count):
+    # Files of shard index (0 <= index < count), every count-th file: the shards of a sample have similar sizes
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard {index}/{count}, it must be 0 <= index < count.")
+    return files[index::count]
+
+
+def make_chain(files, tree, entries=None):
+    # With the entries of each file the chain does not need to open the files to know its length
+    chain = ROOT.TChain(tree)
+    for i, file in enumerate(files):
+        if entries is None:
+            chain.Add(file)
+        else:
+            chain.Add(file, entries[i])
+    return chain
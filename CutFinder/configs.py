@@ -1,8 +1,12 @@
 from CutFinder.algorithms import iterative_bin_cutter
+from CutFinder.cache import function_source
+from CutFinder.chains import count_entries, expand_path, file_stats, make_chain, preview_subset, shard_files
 from CutFinder.functions import applyWP
+from CutFinder.library import FlatColumns, book_flat_column
+from CutFinder.profiling import profiled, stage, track
 from CutFinder.regressors import bayesian_blocks_gaussian
 
-from typing import Optional
+from typing import Optional, Union
 from collections.abc import Callable, Iterable
 
 from array import array
@@ -37,7 +41,7 @@ class Config:
     def __init__(
         self,
         *,
-        samples_path: Optional[str] = None,
+        samples_path: Optional[Union[str, list[str]]] = None,
         pt_branch: str,
         score_branch: str,
         preprocess_function: Optional[Callable] = None,
@@ -55,19 +59,18 @@ class Config:
             print(
                 "If both scaling_function and rate are provided, scaling_function will only inverse-map the final thresholds, rate will not be re-computed."
             )
-            x = sp.Symbol("$OnlinePt")
-            y = sp.Symbol("$OfflinePt")
-            scaling_function = scaling_function(x)
-            inverse_scaling = sp.solve(sp.Eq(y, scaling_function), x)[-1]
-            self.scaling = sp.ccode(scaling_function).replace(
-                "$OnlinePt", self.pt_branch
-            )
-            self.inverse_scaling = sp.lambdify(y, inverse_scaling, "numpy")
+            # shared by all the configs (and clones) with the same scaling expression
+            scaling, self.forward_scaling, self.inverse_scaling = compile_scaling(scaling_function)
+            self.scaling = scaling.replace("$OnlinePt", pt_branch)
         else:
             self.scaling = None
+            self.forward_scaling = None
             self.inverse_scaling = None
 
+        self.scaling_function = scaling_function
         self.samples_path = samples_path
+        self._files = None
+        self._fileStats = None
         self.pt_branch = pt_branch
         self.score_branch = score_branch
 
@@ -78,10 +81,18 @@ class Config:
         ####### to compute
         self.name = None
         self.rdf = None
+        self.columns = None
         self.TotEvents = None
         self.nEvents = None
         self.rate_err = None
         self.WP = None
+        # MAXPT histograms per binning, booked lazily
+        self.rateHists = dict()
+        self.cacheEntry = None
+        self.entries = None
+        # (fraction, max_events) of a preview, see SharedRoot.load
+        self.preview = None
+        self.sharedRoot = None
 
         # flags
         self.isPreprocessed = False
@@ -99,7 +110,7 @@ class Config:
             "pt_branch": self.pt_branch,
             "score_branch": self.score_branch,
             "preprocess_function": self.func,
-            "scaling_function": self.scaling,
+            "scaling_function": self.scaling_function,
             "rate": self.rate,
             "tree": self.tree,
         }
@@ -107,18 +118,106 @@ class Config:
         filtered = {k: v for k, v in base_kwargs.items() if k in params}
         return cls(**filtered)
 
-    def loadRDF(self):
-        if self.rdf is None:
-            chain = ROOT.TChain(self.tree)
-            if "{" in self.samples_path or "}" in self.samples_path:
-                range_part = self.samples_path.split("{")[1].split("}")[0]
-                start, end = map(int, range_part.split(".."))
-                for i in range(start, end + 1):
-                    chain.Add(self.samples_path.replace("{" + range_part + "}", str(i)))
+    def makeChain(self, files=None, entries=None):
+        return make_chain(self.files() if files is None else files, self.tree, entries)
+
+    def files(self):
+        # samples_path expanded once, see CutFinder.chains.expand_path
+        if self._files is None:
+            self._files = expand_path(self.samples_path)
+        return self._files
+
+    def fileStats(self):
+        # (mtime, size) of every file, read in parallel once for all the cache and result store keys
+        if self._fileStats is None:
+            self._fileStats = dict(zip(self.files(), file_stats(self.files())))
+        return self._fileStats
+
+    def identity(self):
+        # Everything the reduced pt/score columns depend on
+        stats = self.fileStats()
+        files = [[file, *stats[file]] for file in self.files()]
+        return {
+            "samples_path": self.samples_path,
+            "files": files,
+            **self._processingIdentity(),
+        }
+
+    def fileIdentity(self, file):
+        # Everything the reduced pt/score columns of a single file depend on, whatever the other files of the sample
+        return {"file": [file, *self.fileStats()[file]], **self._processingIdentity()}
+
+    def _processingIdentity(self):
+        return {
+            "tree": self.tree,
+            "pt_branch": self.pt_branch,
+            "score_branch": self.score_branch,
+            "preprocess": function_source(self.func),
+            "WP": None if self.WP is None else [np.asarray(w, dtype=float).tolist() for w in self.WP],
+            "scaling": self.scaling,
+        }
+
+    # TotEvents, nEvents and columns can hold lazy RDF results, realized on first access.
+    # Book everything with compute/bookRate and run all the graphs together with runGraphs
+    @property
+    def TotEvents(self):
+        if self.cacheEntry is not None:
+            # the totals of the sample come from the partials of all the files
+            self.columns
+        self._TotEvents = _realize(self._TotEvents)
+        return self._TotEvents
+
+    @TotEvents.setter
+    def TotEvents(self, value):
+        self._TotEvents = value
+
+    @property
+    def nEvents(self):
+        if self.cacheEntry is not None:
+            self.columns
+        self._nEvents = _realize(self._nEvents)
+        return self._nEvents
+
+    @nEvents.setter
+    def nEvents(self, value):
+        self._nEvents = value
+
+    @property
+    def columns(self):
+        if hasattr(self._columns, "GetValue"):
+            if self.cacheEntry is None:
+                self._columns = self._columns.GetValue()
+                del self._columns["entry"]
             else:
-                chain.Add(self.samples_path)
-            self.rdf = ROOT.RDataFrame(chain)
-            self.TotEvents = self.rdf.Count().GetValue()
+                # store the partials of the files just read and merge them with the cached ones
+                cache, keys, partials = self.cacheEntry
+                missing = [i for i, partial in enumerate(partials) if partial is None]
+                for i, partial in zip(missing, self._splitColumns(self._columns.GetValue())):
+                    cache.store(keys[i], *partial, evict=False)
+                    partials[i] = partial
+                # once for the whole sample, its entries are kept
+                cache.evict(keep=set(keys))
+                self._mergePartials()
+        return self._columns
+
+    @columns.setter
+    def columns(self, value):
+        self._columns = value
+
+    def lazyResults(self):
+        # Booked results that still need an event loop
+        results = [self._TotEvents, self._nEvents, *self.rateHists.values()]
+        return [r for r in results if hasattr(r, "IsReady") and not r.IsReady()]
+
+    @profiled("loadRDF")
+    def loadRDF(self, staging=None, files=None):
+        # With a StagingCache the chain is built on local copies of the files.
+        # files (default all the files of the sample) can be a subset, e.g. the files missing in the cache.
+        # The configs of the same sample grouped by ConfigReader share the root of the RDataFrame, see SharedRoot
+        if self.rdf is None:
+            files = self.files() if files is None else files
+            root = self.sharedRoot if self.sharedRoot is not None else SharedRoot()
+            self.rdf, self.entries, self.TotEvents = root.load(files, self.tree, staging=staging, preview=self.preview)
 
     def runPreprocess(self):
         if self.func is not None and not self.isPreprocessed:
@@ -126,57 +225,124 @@ class Config:
             self.isPreprocessed = True
 
     def getEntries(self):
-        if self.nEvents is None:
-            self.nEvents = self.rdf.Count().GetValue()
+        if self._nEvents is None:
+            self.nEvents = self.rdf.Count()
 
     def scale(self):
         if self.scaling is not None and not self.isScaled:
             self.rdf = self.rdf.Redefine(self.pt_branch, self.scaling)
             self.isScaled = True
 
-    def makeRate(self, bins, maxRate, overwrite=False):
-        if self.rate is None or overwrite:
+    def bookRate(self, bins):
+        # Book the MAXPT histogram for this binning (once), not needed if the columns are available
+        key = _binning_key(bins)
+        if key not in self.rateHists and self._columns is None and self.rdf is not None:
             if "MAXPT" not in self.rdf.GetDefinedColumnNames():
                 self.rdf = self.rdf.Define("MAXPT", f"Max({self.pt_branch})")
-            else:
+            elif not self.rateHists:
                 self.rdf = self.rdf.Redefine("MAXPT", f"Max({self.pt_branch})")
-
-            if isinstance(bins, tuple):
-                axis = hist.axis.Regular(bins[0], bins[1], bins[2])
-                th = self.rdf.Histo1D(("", "", bins[0], bins[1], bins[2]), "MAXPT")
-            elif isinstance(bins, np.ndarray):
-                axis = hist.axis.Variable(bins)
-                th = self.rdf.Histo1D(
-                    ("", "", len(bins) - 1, array("f", bins)), "MAXPT"
-                )
+            self.rateHists[key] = self.rdf.Histo1D(_histo_model(bins), "MAXPT")
+        return self.rateHists.get(key)
+
+    @profiled("makeRate")
+    def makeRate(self, bins, maxRate, overwrite=False, as_hist=True):
+        # rateHists is filled only if the rate was computed here, a rate given by the user is never overwritten.
+        # Use as_hist=False if only the rate arrays are needed
+        if self.rate is None or overwrite or self.rateHists:
+            key = _binning_key(bins)
+            if key not in self.rateHists and self._columns is not None:
+                # Same TH1D filled straight from the columns
+                th = _maxpt_histo(bins, self.maxPt())
             else:
-                raise ValueError("bins must be either a tuple or a numpy array.")
-
-            th = th.GetValue()
-            h = hist.Hist(axis, storage=hist.storage.Weight())
-
-            for i in range(0, th.GetNbinsX() + 2):
-                h.fill(th.GetBinLowEdge(i), weight=th.GetBinContent(i))
+                th = _realize(self.bookRate(bins))
+            self.rateHists[key] = th
 
-            h_scaled = (self.nEvents / self.TotEvents) * maxRate * h / h.integrate(0, 0).value
-
-            rate = np.array([])
-            rate_err = np.array([])
-            for idx, _ in enumerate(bins):
-                integral = h_scaled.integrate(0, idx)
-                rate = np.append(rate, integral.value)
-                rate_err = np.append(rate_err, integral.variance**0.5)
-            self.rate = rate
-            self.rate_err = rate_err
+            h, self.rate, self.rate_err = _rate_from_histo(
+                th, bins, maxRate, self.nEvents, self.TotEvents, as_hist=as_hist
+            )
             return h
 
-    def compute(self):
-        if not self.isComputed:
+    def bookColumns(self):
+        # Book the extraction of the jagged pt/score columns in flat buffers, see CutFinder.library.FlatColumns
+        if self._columns is not None or self.rdf is None:
+            return
+        branches = [self.pt_branch] if self.score_branch is None else [self.pt_branch, self.score_branch]
+        self.columns = FlatColumns(
+            {column: book_flat_column(self.rdf, branch) for column, branch in zip(["pt", "score"], branches)}
+        )
+
+    def _splitColumns(self, columns):
+        """
+        Split the columns read from the chain (sorted by entry) in the partials (columns, meta) of its files, using the
+        chain entry of each event and the entries of each file.
+        """
+        offsets = columns["offsets"]
+        file_idx = np.searchsorted(np.cumsum(self.entries), columns["entry"], side="right")
+        bounds = np.searchsorted(file_idx, np.arange(len(self.entries) + 1))
+        for i, nEntries in enumerate(self.entries):
+            low, high = bounds[i], bounds[i + 1]
+            partial = {"offsets": offsets[low : high + 1] - offsets[low]}
+            for column in ("pt", "score"):
+                if column in columns:
+                    partial[column] = columns[column][offsets[low] : offsets[high]]
+            yield partial, {"TotEvents": int(nEntries), "nEvents": int(high - low)}
+
+    def _mergePartials(self):
+        # Columns and totals of the sample from the partials of its files, in the order of the files.
+        # The memory-mapped partials are copied in memory by the concatenation, a single file stays memory-mapped
+        _, _, partials = self.cacheEntry
+        if len(partials) == 1:
+            self._columns = partials[0][0]
+        else:
+            self._columns = {
+                "offsets": np.concatenate(
+                    [[0], np.cumsum(np.concatenate([np.diff(columns["offsets"]) for columns, _ in partials]))]
+                ).astype(np.int64)
+            }
+            for column in ("pt", "score"):
+                if column in partials[0][0]:
+                    self._columns[column] = np.concatenate([columns[column] for columns, _ in partials])
+        self._TotEvents = sum(meta["TotEvents"] for _, meta in partials)
+        self._nEvents = sum(meta["nEvents"] for _, meta in partials)
+        self.cacheEntry = None
+
+    def maxPt(self):
+        # Leading pt of each event, every event has at least one object
+        if len(self.columns["offsets"]) == 1:
+            return np.array([], dtype=self.columns["pt"].dtype)
+        return np.maximum.reduceat(self.columns["pt"], self.columns["offsets"][:-1])
+
+    @profiled("compute")
+    def compute(self, cache=None, staging=None, preview=None, shard=None):
+        # Only books the event loop, see runGraphs.
+        # preview is (fraction, max_events), the columns of a preview are never cached.
+        # With shard (index, count) only the files of the shard are computed and cached, see CutFinder.chains.shard_files
+        if not self.isComputed and self.samples_path is not None:
             if self.name is not None:
                 pprint(
                     f"[bold green]Computing {self.__class__.__name__}:[/bold green]\n\t{self.name}\n"
                 )
-            self.loadRDF()
+            files = None
+            if preview is not None:
+                self.preview = preview
+                cache = None
+            if cache is not None:
+                # one cache entry per file, only the files missing in the cache are read
+                files = self.files() if shard is None else shard_files(self.files(), *shard)
+                keys = [cache.key(self, file) for file in files]
+                partials = [cache.load(key) for key in keys]
+                missing = [file for file, partial in zip(files, partials) if partial is None]
+                self.cacheEntry = (cache, keys, partials)
+                if len(missing) == 0:
+                    print(f"\tLoaded {len(files)} files from cache\n")
+                    self._mergePartials()
+                    self.isComputed = True
+                    return
+                if len(missing) < len(files):
+                    print(f"\tLoaded {len(files) - len(missing)}/{len(files)} files from cache\n")
+                files = missing
+
+            self.loadRDF(staging=staging, files=files)
             self.runPreprocess()
             self.apply_WP()
             self.rdf = self.rdf.Filter(f"{self.pt_branch}.size()>0")
@@ -184,7 +350,9 @@ class Config:
             self.getEntries()
             self.isComputed = True
 
-            # self.makeRate(pt_bins, maxRate)
+            if cache is not None:
+                # stored in the cache when realized
+                self.bookColumns()
 
     def apply_WP(self):
         if self.WP is not None and not self.isWPApplied:
@@ -194,6 +362,198 @@ class Config:
             self.isWPApplied = True
 
 
+class SharedRoot:
+    """
+    RDataFrame roots shared by the configs of the same sample (e.g. clones with a different preprocess, WP or
+    scaling): each config books its results on its own branch of the root, so all of them are filled by one event loop.
+    A root is built for each set of files (e.g. the files missing in the cache of a config) and preview.
+    """
+
+    def __init__(self):
+        self.roots = dict()
+
+    def load(self, files, tree, staging=None, preview=None):
+        # Returns the root node, the entries of its files and the number of events it reads
+        key = (tuple(files), tree, preview)
+        if key not in self.roots:
+            self.roots[key] = _load_root(files, tree, staging=staging, preview=preview)
+        return self.roots[key]
+
+
+def _load_root(files, tree, staging=None, preview=None):
+    # In preview mode only a deterministic subset of the entries is read and TotEvents is the size of the subset,
+    # so that the rates are normalised to it and their errors reflect the reduced statistics
+    entries = None
+    limit = None
+    if preview is not None:
+        # the subset is chosen before staging, only its files are copied
+        entries = count_entries(files, tree)
+        total = sum(entries)
+        files, entries, limit = preview_subset(files, entries, *preview)
+        print(f"\tPreview: {limit}/{total} events from {len(files)} files\n")
+    if staging is not None:
+        files = staging.stage(files)
+    # from the metadata of the files, without any event loop
+    entries = count_entries(files, tree) if entries is None else entries
+    rdf = ROOT.RDataFrame(make_chain(files, tree, entries))
+    track(rdf)
+    TotEvents = sum(entries)
+    if limit is not None and limit < TotEvents:
+        # the file chosen last (the last of the chain) is read only up to limit
+        rdf = rdf.Filter(f"rdfentry_ < {limit}")
+        TotEvents = limit
+    return rdf, entries, TotEvents
+
+
+_compiled_scalings = dict()
+
+
+def compile_scaling(scaling_function):
+    """
+    C code (of $OnlinePt), forward and inverse functions of an online-to-offline pT scaling function,
+    memoized by sympy expression.
+    The inverse is solved with sympy for polynomials up to the second degree, otherwise it is computed numerically
+    with _numeric_inverse (the scaling must be increasing).
+    """
+    x = sp.Symbol("$OnlinePt")
+    expression = sp.sympify(scaling_function(x))
+    key = sp.srepr(expression)
+    if key not in _compiled_scalings:
+        forward = sp.lambdify(x, expression, "numpy")
+        inverse = None
+        if expression.is_polynomial(x) and sp.degree(expression, x) <= 2:
+            y = sp.Symbol("$OfflinePt")
+            solutions = sp.solve(sp.Eq(y, expression), x)
+            if len(solutions) > 0:
+                inverse = sp.lambdify(y, solutions[-1], "numpy")
+        if inverse is None:
+            inverse = _numeric_inverse(forward)
+        _compiled_scalings[key] = (sp.ccode(expression), forward, inverse)
+    return _compiled_scalings[key]
+
+
+def _numeric_inverse(forward, iterations=200, expansions=64):
+    # Inverse of an increasing function by vectorized bisection, the brackets are expanded until they contain the values
+    def evaluate(pt):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.broadcast_to(forward(pt), pt.shape)
+
+    def inverse(y):
+        y = np.asarray(y, dtype=np.float64)
+        low = np.zeros_like(y)
+        high = np.ones_like(y)
+        for _ in range(expansions):
+            below = evaluate(low) > y
+            above = evaluate(high) < y
+            if not np.any(below) and not np.any(above):
+                break
+            low = np.where(below, 2 * low - 1, low)
+            high = np.where(above, 2 * high, high)
+        else:
+            raise ValueError("Cannot invert the scaling function: not increasing or values out of range.")
+
+        for _ in range(iterations):
+            mid = (low + high) / 2
+            converged = np.bitwise_or(mid == low, mid == high)
+            if np.all(converged):
+                break
+            below = evaluate(mid) < y
+            low = np.where(below, mid, low)
+            high = np.where(below, high, mid)
+        return (low + high) / 2
+
+    return inverse
+
+
+def _realize(result):
+    return result.GetValue() if hasattr(result, "GetValue") else result
+
+
+def _binning_key(bins):
+    if isinstance(bins, tuple):
+        return tuple(bins)
+    return tuple(np.asarray(bins).tolist())
+
+
+def _histo_model(bins):
+    if isinstance(bins, tuple):
+        return ("", "", bins[0], bins[1], bins[2])
+    elif isinstance(bins, np.ndarray):
+        return ("", "", len(bins) - 1, array("f", bins))
+    else:
+        raise ValueError("bins must be either a tuple or a numpy array.")
+
+
+def _maxpt_histo(bins, maxpt):
+    th = ROOT.TH1D(*_histo_model(bins))
+    th.SetDirectory(ROOT.nullptr)
+    maxpt = np.asarray(maxpt, dtype=np.float64)
+    if len(maxpt) > 0:
+        th.FillN(len(maxpt), maxpt, ROOT.nullptr)
+    return th
+
+
+def _histo_contents(th):
+    # Bin contents of a TH1D, flow bins included, read in one go
+    ncells = th.GetNcells()
+    buffer = th.GetArray()
+    buffer.reshape((ncells,))
+    return np.frombuffer(buffer, dtype=np.float64, count=ncells).copy()
+
+
+def _rate_from_histo(th, bins, maxRate, nEvents, TotEvents, as_hist=True):
+    """
+    Cumulative rate (integral from each pt edge up to the overflow) of the MAXPT histogram,
+    normalised to nEvents / TotEvents * maxRate.
+    The bins variances are the squared contents, as the hist.Hist filled with weight=content of the past.
+    If as_hist is False the hist.Hist is not built and None is returned in its place.
+    """
+    if isinstance(bins, tuple):
+        axis = hist.axis.Regular(bins[0], bins[1], bins[2])
+    elif isinstance(bins, np.ndarray):
+        axis = hist.axis.Variable(bins)
+    else:
+        raise ValueError("bins must be either a tuple or a numpy array.")
+
+    contents = _histo_contents(th)
+    # integral from bin idx (flow cell idx + 1) to the overflow
+    integral = np.cumsum(contents[::-1])[::-1][1:]
+    integral_var = np.cumsum((contents**2)[::-1])[::-1][1:]
+
+    scale = (nEvents / TotEvents) * maxRate / integral[0]
+    rate = integral * scale
+    rate_err = integral_var**0.5 * scale
+
+    h = None
+    if as_hist:
+        h = hist.Hist(axis, storage=hist.storage.Weight())
+        view = h.view(flow=True)
+        view.value = contents
+        view.variance = contents**2
+    return h, rate, rate_err
+
+
+def _wp_mask(pt, score, pt_bins, score_cuts):
+    # NumPy version of WP_mask (include/functions.cpp) with the same float32 edges and cuts used by applyWP
+    pt_bins = np.asarray(pt_bins, dtype=np.float64)
+    argsortidx = np.argsort(pt_bins)
+    edges = pt_bins[argsortidx].astype(np.float32)
+    cuts = np.nan_to_num(np.asarray(score_cuts, dtype=np.float64)[argsortidx], neginf=-9999.0).astype(np.float32)
+
+    bin_idx = np.searchsorted(edges, pt, side="right") - 1
+    mask = bin_idx >= 0
+    mask[mask] = score[mask] >= cuts[bin_idx[mask]]
+    return mask
+
+
+def runGraphs(configs):
+    # Realize the booked results of all the configs (counts, columns, MAXPT histograms) running every event loop once
+    results = [result for config in configs for result in config.lazyResults()]
+    if len(results) > 0:
+        with stage("runGraphs"):
+            ROOT.RDF.RunGraphs(results)
+
+
 class ConfigEff:
     pass
     # implement at the end to plot also efficiencies with the WP that were found
@@ -203,10 +563,10 @@ class ConfigRef(Config):
     def __init__(
         self,
         *,
-        samples_path: Optional[str] = None,
+        samples_path: Optional[Union[str, list[str]]] = None,
         pt_branch: str,
         preprocess_function: Optional[Callable] = None,
-        scaling_function: Optional[str] = None,
+        scaling_function: Optional[Callable] = None,
         rate: Optional[np.array] = None,
         tree: str = "Events",
         score_branch: Optional[str] = None,  # Needed only for applying WP
@@ -228,11 +588,11 @@ class ConfigObj(Config):
     def __init__(
         self,
         *,
-        samples_path: Optional[str] = None,
+        samples_path: Optional[Union[str, list[str]]] = None,
         pt_branch: str,
         score_branch: str,
         preprocess_function: Optional[Callable] = None,
-        scaling_function: Optional[str] = None,
+        scaling_function: Optional[Callable] = None,
         tree: str = "Events",
         refs: Optional[list[str]] = None,
     ):
@@ -249,6 +609,65 @@ class ConfigObj(Config):
         self.refs = refs
         self.records = dict()
 
+    def evaluateWP(self, WPs, bins, maxRate):
+        """
+        Rates of a batch of working points [(pt_bins, score_cuts), ...] computed on the columns of this obj,
+        without reading the sample again. If the columns were not extracted (an algorithm streaming the sample, see
+        CutFinder.algorithms.streams) the MAXPT histogram of every WP is booked on an applyWP branch of obj.rdf and
+        all of them are filled in one event loop, no column is read in memory.
+        Returns rate, rate_err with shape (len(WPs), len(bins)), the same of makeRate on obj.clone(ConfigRef, WP=WP).
+        If scaling is applied, the WP pt_bins (online pT) are mapped to offline pT with the scaling function.
+        """
+        if self._columns is None and self.rdf is not None:
+            return self._streamWP(WPs, bins, maxRate)
+        self.bookColumns()
+        offsets = self.columns["offsets"]
+        pt = self.columns["pt"]
+        score = self.columns["score"]
+
+        rates = []
+        rates_err = []
+        for wp_bins, wp_cuts in WPs:
+            if self.scaling is not None:
+                wp_bins = self.forward_scaling(np.asarray(wp_bins, dtype=np.float64))
+            mask = _wp_mask(pt, score, wp_bins, wp_cuts)
+
+            if len(offsets) > 1:
+                nPassing = np.add.reduceat(mask.astype(np.int64), offsets[:-1])
+                maxpt = np.maximum.reduceat(np.where(mask, pt, -np.inf), offsets[:-1])[nPassing > 0]
+            else:
+                maxpt = np.array([])
+
+            _, rate, rate_err = _rate_from_histo(
+                _maxpt_histo(bins, maxpt), bins, maxRate, len(maxpt), self.TotEvents, as_hist=False
+            )
+            rates.append(rate)
+            rates_err.append(rate_err)
+        return np.array(rates), np.array(rates_err)
+
+    def _streamWP(self, WPs, bins, maxRate):
+        # evaluateWP in an event loop: MAXPT histogram and number of events of every WP, like compute on a clone
+        booked = []
+        for wp_bins, wp_cuts in WPs:
+            if self.scaling is not None:
+                wp_bins = self.forward_scaling(np.asarray(wp_bins, dtype=np.float64))
+            rdf = applyWP(self.pt_branch, self.score_branch, wp_bins, wp_cuts, self.rdf).Filter(
+                f"{self.pt_branch}.size()>0"
+            )
+            rdf = rdf.Define("WPMAXPT", f"Max({self.pt_branch})")
+            booked.append((rdf.Histo1D(_histo_model(bins), "WPMAXPT"), rdf.Count()))
+        ROOT.RDF.RunGraphs([result for results in booked for result in results])
+
+        rates = []
+        rates_err = []
+        for th, count in booked:
+            _, rate, rate_err = _rate_from_histo(
+                th.GetValue(), bins, maxRate, count.GetValue(), self.TotEvents, as_hist=False
+            )
+            rates.append(rate)
+            rates_err.append(rate_err)
+        return np.array(rates), np.array(rates_err)
+
     def addToRecord(self, ref, record_name, bins, cuts, rate, cuts_err=None, chi2=None):
         mask = np.bitwise_and(cuts != -np.inf, cuts > -9999.0)
         bins = bins[mask]
@@ -1,5 +1,7 @@
 import numpy as np
 
+from CutFinder.library import register_wp
+
 #!All the function are supposed to be used also with functools.partial to be used as preprocess_function in Configs.
 #!I.E. RDF must be the last argument of the function and they must return the modified RDF.
 
@@ -12,13 +14,12 @@ def applyWP(pt_branch, score_branch, pt_bins, score_thresholds, rdf):
     pt_bins = pt_bins[argsortidx].tolist()
     score_thresholds = np.array(score_thresholds)[argsortidx]
     score_thresholds = np.nan_to_num(score_thresholds, neginf=-9999.0).tolist()
-    pt_bins = "{" + ", ".join(map(str, pt_bins)) + "}"
-    score_thresholds = "{" + ", ".join(map(str, score_thresholds)) + "}"
+    wp = register_wp(pt_bins, score_thresholds)
     rdf = (
         rdf.Filter(f"{pt_branch}.size()>0")
         .Define(
             "WPmask",
-            f"WP_mask({pt_branch}, {score_branch}, {pt_bins}, {score_thresholds})",
+            f"WP_mask({pt_branch}, {score_branch}, {wp})",
         )
         .Redefine(pt_branch, f"{pt_branch}[WPmask]")
         .Redefine(score_branch, f"{score_branch}[WPmask]")
@@ -0,0 +1,123 @@
+import fcntl
+import hashlib
+import os
+import shutil
+
+import numpy as np
+import ROOT
+
+from CutFinder.cache import default_cache_path
+
+#! The C++ helpers of include/functions.cpp are compiled once with ACLiC in a library keyed by the hash of the
+#! source and of the ROOT version, later starts only load it.
+
+SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "include", "functions.cpp")
+
+_registered_wps = dict()
+
+
+def library_dir():
+    return os.path.join(default_cache_path(), "lib")
+
+
+def load_functions(build_dir=None):
+    """
+    Load the compiled helpers, compiling them if the library for this source and ROOT version does not exist yet.
+    Falls back to declaring the source in the interpreter if the compilation fails.
+    """
+    with open(SOURCE, "rb") as fp:
+        source = fp.read()
+    key = hashlib.sha256(source + ROOT.gROOT.GetVersion().encode()).hexdigest()[:16]
+
+    build_dir = os.path.expanduser(build_dir or library_dir())
+    os.makedirs(build_dir, exist_ok=True)
+    # ACLiC recompiles only if the source is newer than the library, the copy keyed by hash never changes
+    macro = os.path.join(build_dir, f"functions_{key}.cpp")
+
+    # worker processes may compile at the same time
+    with open(os.path.join(build_dir, f"functions_{key}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(macro):
+            shutil.copyfile(SOURCE, f"{macro}.tmp")
+            os.replace(f"{macro}.tmp", macro)
+        compiled = ROOT.gSystem.CompileMacro(macro, "kO", "", build_dir) == 1
+
+    if not compiled:
+        print(f"Warning: could not compile {SOURCE}, declaring it in the interpreter.")
+        ROOT.gInterpreter.Declare(f'#include "{SOURCE}"')
+
+
+def register_wp(pt_bins, score_cuts):
+    """
+    Register a working point (pt_bins sorted ascendingly, float32 like WP_mask) for WP_mask(pt, score, id).
+    The same working point is registered only once. Returns its id
+    """
+    key = (
+        tuple(np.asarray(pt_bins, dtype=np.float32).tolist()),
+        tuple(np.asarray(score_cuts, dtype=np.float32).tolist()),
+    )
+    if key not in _registered_wps:
+        _registered_wps[key] = int(
+            ROOT.RegisterWP(ROOT.std.vector["float"](key[0]), ROOT.std.vector["float"](key[1]))
+        )
+    return _registered_wps[key]
+
+
+# Runtime state of the selection of iterative_bin_cutter, see BinSelected in include/functions.cpp
+
+
+def new_cut_state(nBins):
+    return int(ROOT.NewCutState(nBins))
+
+
+def set_current_bin(state, bin):
+    ROOT.SetCurrentBin(state, bin)
+
+
+def set_cut(state, bin, cut):
+    ROOT.SetCut(state, bin, float(cut))
+
+
+# Jagged columns read in flat buffers, see FlatColumnHelper in include/functions.cpp
+
+
+def book_flat_column(rdf, column):
+    # Lazy FlatColumn of a jagged column (RVec or vector of numbers) with the entry and the size of every event
+    column_type = str(rdf.GetColumnType(column))
+    value_type = column_type[column_type.index("<") + 1 : column_type.rindex(">")]
+    return ROOT.BookFlatColumn[value_type](ROOT.RDF.AsRNode(rdf), column)
+
+
+class FlatColumns:
+    """
+    Lazy flat columns {name: book_flat_column(...)} booked on the same RDataFrame. GetValue returns the entries, the
+    offsets of the events in the flat arrays and the values of every column, sorted by entry whatever the order of
+    the IMT threads.
+    """
+
+    def __init__(self, results):
+        self.results = results
+
+    def GetValue(self):
+        columns = dict()
+        for name, result in self.results.items():
+            flat = result.GetValue()
+            # copies of the buffers, through the array interface of std::vector
+            entries = np.array(flat.entries, copy=True).astype(np.int64)
+            counts = np.array(flat.counts, copy=True).astype(np.int64)
+            values = np.array(flat.values, copy=True)
+            offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+            if np.all(entries[1:] > entries[:-1]):
+                np.cumsum(counts, out=offsets[1:])
+            else:
+                # the events of each slot are in order, the slots are not
+                order = np.argsort(entries, kind="stable")
+                starts = offsets[:-1].copy()
+                np.cumsum(counts[:-1], out=starts[1:])
+                entries, counts = entries[order], counts[order]
+                np.cumsum(counts, out=offsets[1:])
+                values = values[np.repeat(starts[order] - offsets[:-1], counts) + np.arange(offsets[-1])]
+            columns["entry"] = entries
+            columns["offsets"] = offsets
+            columns[name] = values
+        return columns
@@ -0,0 +1,243 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+
+import numpy as np
+import ROOT
+
+from CutFinder.algorithms import streams
+from CutFinder.chains import shard_files
+from CutFinder.configs import runGraphs
+from CutFinder.library import load_functions
+from CutFinder import profiling
+from CutFinder.readers import ConfigReader
+
+#! Processing of a single (ref, obj) pair: bin-by-bin cuts, regression and rate of the fitted WP.
+#! The objs (each one with all its refs) can be split among worker processes, each one with its own ROOT interpreter.
+
+
+def setup_root(ncpus, profile=False):
+    load_functions()
+    if profile:
+        profiling.enable()
+
+    if ncpus > 1:
+        ROOT.EnableImplicitMT(ncpus)
+
+
+def get_pairs(refs, objs):
+    for ref in refs:
+        for obj in objs:
+            if obj.refs is not None:
+                if ref.name not in obj.refs:
+                    continue
+            yield ref, obj
+
+
+def process_pair(ref, obj, glob, regressor_only=False, output=None, results=None):
+    # Results are saved in obj.records[ref.name]. With a ResultStore the full cuts of unchanged pairs are not computed
+    if ((obj.scaling is not None and ref.scaling is None) or
+        (obj.scaling is None and ref.scaling is not None)):
+        raise ValueError(f"You are comparing Offline and Online pT between obj {obj.name} and ref {ref.name}. Please provide scaling functions for both configurations or none.")
+
+    #inverse scale if scaling is applied
+    if obj.scaling is not None:
+        cut_bins = obj.inverse_scaling(np.array(glob.pt_bins))
+    else:
+        cut_bins = glob.pt_bins
+
+    stored = None
+    if not regressor_only and results is not None:
+        stored = results.load(ref, obj, glob)
+    if stored is not None:
+        print(f"Loaded the cuts of (Obj: {obj.name}, Ref: {ref.name}) from the result store")
+        cuts, cuts_err, rate, ref_rate = stored["cuts"], stored["cuts_err"], stored["rate"], stored["ref_rate"]
+
+    elif not regressor_only:
+        with profiling.stage("algorithm"):
+            cuts, cuts_err, rate = glob.algo(ref, obj, glob, **glob.algo_kwargs)
+        if results is not None:
+            # stored pair by pair, a run stopped halfway resumes from here
+            results.store(ref, obj, glob, cuts, cuts_err, rate, ref.rate)
+
+    else:
+        #load json record to get cuts
+        with open(f"{output}/{obj.name}/records.json","r") as fp:
+            records = json.load(fp)
+        ref_rate = records[ref.name]["ref_rate"]
+        cut_record = records[ref.name]["full"]
+        cut_bins = np.array(cut_record["bins"])
+        cuts = np.array(cut_record["cuts"])
+        rate= np.array(cut_record["rate"])
+        cuts_err = np.array(cut_record.get("cuts_err", np.ones_like(cuts)))
+
+    #create record and save cuts
+    obj.addToRecord(ref, "full", cut_bins, cuts, rate, cuts_err=cuts_err)
+
+    # in regressor only mode (or from the result store, the ref is not computed), save also the ref rate
+    if regressor_only or stored is not None:
+        obj.records[ref.name]["ref_rate"] = ref_rate
+
+    with profiling.stage("regressor"):
+        fitted_cut_bins, fitted_cuts, chi2 = glob.regressor(
+            cut_bins,
+            cuts,
+            sigma = cuts_err,
+            fitrange=glob.fitrange,
+            **glob.regressor_kwargs,
+        )
+    # rate of the fitted WP, evaluated on the columns of obj if extracted, otherwise in an event loop
+    with profiling.stage("fitted WP"):
+        fitted_rate, _ = obj.evaluateWP(
+            [[fitted_cut_bins, fitted_cuts]], glob.pt_bins, glob.maxRate
+        )
+
+    #create record and save cuts
+    obj.addToRecord(
+        ref,
+        "fitted",
+        fitted_cut_bins,
+        fitted_cuts,
+        fitted_rate[0],
+        chi2=chi2,
+    )
+
+
+def compute_configs(
+    refs, objs, glob, cache=None, regressor_only=False, staging=None, preview=None, results=None
+):
+    # Book counts, columns and reference MAXPT histograms, then run all the event loops at once.
+    # With an algorithm streaming the objs (see streams) their columns are neither extracted nor cached: the cut finding
+    # and the fitted WPs read them in their own event loops.
+    # In regressor-only mode only the objs are needed, to evaluate the fitted WPs, as the refs whose pairs are all in
+    # the ResultStore results. preview is (fraction, max_events), see Config.loadRDF
+    if results is not None:
+        missing = {ref.name for ref, obj in get_pairs(refs, objs) if results.load(ref, obj, glob) is None}
+        refs = [ref for ref in refs if ref.name in missing]
+    configs = objs if regressor_only else refs + objs
+    stream = streams(glob)
+    for config in configs:
+        config.compute(cache=None if stream and config in objs else cache, staging=staging, preview=preview)
+    if not stream:
+        for obj in objs:
+            obj.bookColumns()
+    if not regressor_only:
+        for ref in refs:
+            if ref.rate is None:
+                ref.bookRate(glob.pt_bins)
+    runGraphs(configs)
+
+
+def compute_shard(configs, shard, cache, staging=None):
+    """
+    Map step of a sharded run: the columns of the files of shard (index, count) of every config are computed in one
+    go and stored per file in cache, the files already there are skipped (a failed shard can be run again).
+    The partials of all the shards are merged by a normal run on the same cache, see missing_shards.
+    """
+    configs = [
+        config for config in configs if config.samples_path is not None and len(shard_files(config.files(), *shard)) > 0
+    ]
+    for config in configs:
+        config.compute(cache=cache, staging=staging, shard=shard)
+    runGraphs(configs)
+    for config in configs:
+        # stored in the cache when realized
+        config.columns
+
+
+def missing_shards(configs, cache):
+    # Files of every config whose columns are not in cache yet, i.e. whose shard did not run (or failed)
+    missing = dict()
+    for config in configs:
+        if config.samples_path is None:
+            continue
+        files = [file for file in config.files() if not cache.contains(cache.key(config, file))]
+        if len(files) > 0:
+            missing[config.name] = files
+    return missing
+
+
+def parse_shard(shard):
+    # "i/N" -> (i, N)
+    index, count = shard.split("/")
+    return int(index), int(count)
+
+
+def _obj_worker(args):
+    # Configs are read again from the config file: preprocess functions defined there cannot be pickled
+    path, ref_names, obj_name, cache, regressor_only, output, staging, preview, results = args
+    profiler = profiling.profiler()
+    config_reader = ConfigReader(path)
+    refs = [ref for ref in config_reader.refs if ref.name in ref_names]
+    obj = next(obj for obj in config_reader.objs if obj.name == obj_name)
+
+    compute_configs(
+        refs,
+        [obj],
+        config_reader.glob,
+        cache=cache,
+        regressor_only=regressor_only,
+        staging=staging,
+        preview=preview,
+        results=results,
+    )
+    for ref in refs:
+        process_pair(ref, obj, config_reader.glob, regressor_only=regressor_only, output=output, results=results)
+    # stages of this obj only, the worker can process several objs
+    stages = None
+    if profiler is not None:
+        stages, profiler.stages = profiler.stages, dict()
+    return {ref.name: obj.records[ref.name] for ref in refs}, stages
+
+
+def process_pairs(
+    path,
+    pairs,
+    glob,
+    processes,
+    ncpus,
+    cache=None,
+    regressor_only=False,
+    output=None,
+    staging=None,
+    preview=None,
+    results=None,
+):
+    """
+    Process the (ref, obj) pairs in a pool of worker processes, each one using ncpus // processes threads.
+    There is one task per obj with all its refs, so every obj is read by a single worker. With a cache the refs
+    shared by several objs are first computed and cached here (ROOT must be set up, see setup_root): the workers load
+    them from the cache instead of reading them again, all at the same time and on the same cache entries.
+    The records of every pair are merged back in obj.records, the profiled stages (if enabled) in the profiler.
+    """
+    profiler = profiling.profiler()
+    tasks = dict()
+    for ref, obj in pairs:
+        tasks.setdefault(obj.name, (obj, []))[1].append(ref)
+
+    if cache is not None and preview is None and not regressor_only:
+        # refs of more than one obj with cuts still to find, see compute_configs
+        objs_per_ref = dict()
+        for obj, refs in tasks.values():
+            for ref in refs:
+                if results is None or results.load(ref, obj, glob) is None:
+                    objs_per_ref.setdefault(ref.name, (ref, []))[1].append(obj)
+        shared = [ref for ref, objs in objs_per_ref.values() if len(objs) > 1]
+        if len(shared) > 0:
+            # all the files of the refs, in one go
+            compute_shard(shared, (0, 1), cache, staging=staging)
+
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=setup_root,
+        initargs=(max(1, ncpus // processes), profiler is not None),
+    ) as pool:
+        args = [
+            (path, [ref.name for ref in refs], obj.name, cache, regressor_only, output, staging, preview, results)
+            for obj, refs in tasks.values()
+        ]
+        for (obj, _), (records, stages) in zip(tasks.values(), pool.map(_obj_worker, args)):
+            obj.records.update(records)
+            if stages is not None:
+                profiler.merge(stages)
@@ -1,3 +1,10 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import multiprocessing
+import os
+from types import SimpleNamespace
+
 from cycler import cycler
 import mplhep as hep
 import matplotlib.pyplot as plt
@@ -62,9 +69,31 @@ markers = ["v", "^", "X", "P", "d", "*", "p", "o"]
 
 
 class Plotter:
-    def __init__(self, **kwargs):
+    def __init__(self, formats=("png", "pdf"), label="", **kwargs):
+        # label is appended to the titles, e.g. " (preview)"
+        self.formats = formats
+        self.label = label
         self.kwargs = kwargs
 
+    def save(self, fig, output, name, plot):
+        for fmt in self.formats:
+            fig.savefig(f"{output}/{name}/{plot}.{fmt}")
+        plt.close(fig)
+
+    def is_up_to_date(self, output, name, plot, content_hash):
+        # Figures are skipped if the hash of their content did not change and all the formats are there
+        hash_file = f"{output}/{name}/.{plot}.hash"
+        if not os.path.exists(hash_file):
+            return False
+        with open(hash_file, "r") as fp:
+            if fp.read().strip() != content_hash:
+                return False
+        return all(os.path.exists(f"{output}/{name}/{plot}.{fmt}") for fmt in self.formats)
+
+    def write_hash(self, output, name, plot, content_hash):
+        with open(f"{output}/{name}/.{plot}.hash", "w") as fp:
+            fp.write(content_hash)
+
     def plot_rates(self, glob, obj, output=None):
         isScaled = obj.isScaled  # check if both are scaled already performed in main
 
@@ -169,7 +198,7 @@ class Plotter:
         # scale
         main_ax.set_yscale("log")
         # labels
-        main_ax.set_title(f"{obj.name}")
+        main_ax.set_title(f"{obj.name}{self.label}")
         main_ax.set_ylabel("Rate [kHz]")
         ratio_ax.set_ylabel("Obj/Ref")
         if isScaled:
@@ -186,9 +215,7 @@ class Plotter:
         # lims
         main_ax.set_ylim(0.3, glob.maxRate * 10)
         ratio_ax.set_ylim(0, 2)
-        fig.savefig(f"{output}/{obj.name}/rates.png")
-        fig.savefig(f"{output}/{obj.name}/rates.pdf")
-        plt.close(fig)
+        self.save(fig, output, obj.name, "rates")
 
     def plot_cuts(self, obj, output=None):
         records = obj.records
@@ -257,7 +284,7 @@ class Plotter:
             labels.append(ref)
 
         ax.legend(custom_lines, labels, loc="upper right", fontsize="small")
-        ax.set_title(f"{obj.name} Cuts")
+        ax.set_title(f"{obj.name} Cuts{self.label}")
         ax.set_xlabel("Online pT [GeV]")
         ax.set_ylabel("Cut Value (score)")
 
@@ -265,6 +292,54 @@ class Plotter:
         if y_min > -1 and y_max < 1:
             ax.set_ylim(-1, 1)
         ax.grid(which="major", linestyle="--", linewidth=0.5, alpha=0.7)
-        fig.savefig(f"{output}/{obj.name}/cuts.png")
-        fig.savefig(f"{output}/{obj.name}/cuts.pdf")
-        plt.close(fig)
+        self.save(fig, output, obj.name, "cuts")
+
+
+def _content_hash(content):
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _render(task):
+    name, records, pt_bins, maxRate, isScaled, output, formats, force, label = task
+    plotter = Plotter(formats=formats, label=label)
+    obj = SimpleNamespace(name=name, records=records, isScaled=isScaled)
+    glob = SimpleNamespace(pt_bins=pt_bins, maxRate=maxRate)
+
+    rendered = []
+    rates_hash = _content_hash([records, pt_bins, maxRate, isScaled, label])
+    if force or not plotter.is_up_to_date(output, name, "rates", rates_hash):
+        plotter.plot_rates(glob, obj, output=output)
+        plotter.write_hash(output, name, "rates", rates_hash)
+        rendered.append("rates")
+
+    cuts_hash = _content_hash([records, label])
+    if force or not plotter.is_up_to_date(output, name, "cuts", cuts_hash):
+        plotter.plot_cuts(obj, output=output)
+        plotter.write_hash(output, name, "cuts", cuts_hash)
+        rendered.append("cuts")
+    return rendered
+
+
+def plot_objs(glob, objs, output, formats=("png", "pdf"), processes=1, force=False, label=""):
+    """
+    Render the rates and cuts plots of every obj in a process pool, label is appended to the titles.
+    Plots whose records did not change since the last render are skipped (unless force is True).
+    """
+    pt_bins = glob.pt_bins.tolist() if isinstance(glob.pt_bins, np.ndarray) else list(glob.pt_bins)
+    tasks = [
+        (obj.name, obj.records, pt_bins, glob.maxRate, obj.scaling is not None, output, tuple(formats), force, label)
+        for obj in objs
+    ]
+    if processes > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(processes, len(tasks)), mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            rendered = list(pool.map(_render, tasks))
+    else:
+        rendered = [_render(task) for task in tasks]
+
+    for obj, plots in zip(objs, rendered):
+        if len(plots) == 0:
+            print(f"Plots of {obj.name} are up to date")
@@ -0,0 +1,162 @@
+from contextlib import contextmanager
+import functools
+import json
+import resource
+import time
+
+import ROOT
+
+#! Profiling of the stages of a run (--profile): wall and CPU time, peak RSS, RDF event loops, bytes read and JIT time.
+#! The stages are no-ops until a Profiler is enabled. Times of nested stages are also counted in the outer ones.
+#! The RDF event loops are lazy: compute and makeRate of the refs only book them, they run in the runGraphs stage.
+
+# Accumulates the seconds of the "Just-in-time compilation phase completed in X seconds." messages of RDataFrame
+JIT_LOG = """
+#include <ROOT/RLogger.hxx>
+#include <ROOT/RDF/Utils.hxx>
+#include <memory>
+#include <string>
+
+namespace CutFinderProfiling {
+using namespace ROOT;
+using namespace ROOT::Experimental;
+
+double jitSeconds = 0.;
+
+class JitLogHandler : public RLogHandler {
+public:
+  bool Emit(const RLogEntry &entry) override {
+    const std::string key = "Just-in-time compilation phase completed in ";
+    auto pos = entry.fMessage.find(key);
+    if (pos != std::string::npos) {
+      try {
+        jitSeconds += std::stod(entry.fMessage.substr(pos + key.size()));
+      } catch (...) {
+        // "in less than 1ms."
+      }
+    }
+    // the info messages of RDataFrame are only collected, the others are printed as usual
+    return entry.fLevel < ELogLevel::kInfo || entry.fChannel != &ROOT::Detail::RDF::RDFLogChannel();
+  }
+};
+
+void Install() {
+  ROOT::Detail::RDF::RDFLogChannel().SetVerbosity(ELogLevel::kInfo);
+  RLogManager::Get().PushFront(std::make_unique<JitLogHandler>());
+}
+} // namespace CutFinderProfiling
+"""
+
+STATS = ("calls", "wall", "cpu", "peak_rss", "event_loops", "bytes_read", "jit")
+
+_profiler = None
+
+
+class Profiler:
+    def __init__(self):
+        self.stages = dict()
+        self.roots = []
+        self.jit = ROOT.gInterpreter.Declare(JIT_LOG)
+        if self.jit:
+            ROOT.CutFinderProfiling.Install()
+        else:
+            print("Warning: cannot collect the JIT time of RDataFrame.")
+
+    def track(self, rdf):
+        # GetNRuns of the roots, one per event loop manager
+        self.roots.append(rdf)
+
+    def snapshot(self):
+        return {
+            "wall": time.perf_counter(),
+            "cpu": time.process_time(),
+            "event_loops": sum(rdf.GetNRuns() for rdf in self.roots),
+            "bytes_read": ROOT.TFile.GetFileBytesRead(),
+            "jit": ROOT.CutFinderProfiling.jitSeconds if self.jit else 0.0,
+        }
+
+    @contextmanager
+    def stage(self, name):
+        start = self.snapshot()
+        try:
+            yield
+        finally:
+            end = self.snapshot()
+            stats = self.stages.setdefault(name, dict.fromkeys(STATS, 0))
+            stats["calls"] += 1
+            for key, value in end.items():
+                stats[key] += value - start[key]
+            stats["peak_rss"] = max(stats["peak_rss"], peak_rss())
+
+    def merge(self, stages):
+        # Stages of a worker process
+        for name, other in stages.items():
+            stats = self.stages.setdefault(name, dict.fromkeys(STATS, 0))
+            for key, value in other.items():
+                stats[key] = max(stats[key], value) if key == "peak_rss" else stats[key] + value
+
+    def save(self, path):
+        with open(path, "w") as fp:
+            json.dump({"stages": self.stages}, fp, indent=4)
+
+    def table(self):
+        from rich.table import Table
+
+        table = Table(title="Profile")
+        for column in ["stage", "calls", "wall [s]", "CPU [s]", "peak RSS [MB]", "event loops", "read [MB]", "JIT [s]"]:
+            table.add_column(column)
+        for name, stats in self.stages.items():
+            table.add_row(
+                name,
+                str(stats["calls"]),
+                f"{stats['wall']:.2f}",
+                f"{stats['cpu']:.2f}",
+                f"{stats['peak_rss'] / 1024**2:.0f}",
+                str(stats["event_loops"]),
+                f"{stats['bytes_read'] / 1024**2:.1f}",
+                f"{stats['jit']:.2f}",
+            )
+        return table
+
+
+def peak_rss():
+    # bytes, ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def enable():
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def profiler():
+    return _profiler
+
+
+@contextmanager
+def stage(name):
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.stage(name):
+            yield
+
+
+def profiled(name):
+    # Decorator running the whole function in a stage
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def track(rdf):
+    if _profiler is not None:
+        _profiler.track(rdf)
@@ -1,5 +1,6 @@
 import importlib
-from CutFinder.configs import ConfigObj, ConfigRef, GlobalConf
+import json
+from CutFinder.configs import ConfigObj, ConfigRef, GlobalConf, SharedRoot
 
 
 class ConfigReader:
@@ -29,3 +30,14 @@ class ConfigReader:
                 self.glob = obj
         if self.glob is None:
             raise ValueError("No GlobalConf instance found in the config file.")
+
+        # configs of the same sample share the root of their RDataFrame and are read in one event loop
+        self.groups = dict()
+        for config in self.refs + self.objs:
+            if config.samples_path is not None:
+                key = (json.dumps(config.samples_path), config.tree)
+                self.groups.setdefault(key, []).append(config)
+        for configs in self.groups.values():
+            root = SharedRoot()
+            for config in configs:
+                config.sharedRoot = root
@@ -0,0 +1,197 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+from urllib.parse import urlparse
+import zlib
+
+#! Local staging of the input files: the files of a chain are copied in parallel to a local folder and the chain is
+#! built on the local copies. The copies are kept between runs (verified by size and modification time of the
+#! source, optionally by checksum) and the least recently used ones are evicted above max_size.
+#! Copiers are picked by URL scheme and can be replaced with register_copier.
+
+
+def adler32(path, chunk_size=1024**2):
+    checksum = 1
+    with open(path, "rb") as fp:
+        while chunk := fp.read(chunk_size):
+            checksum = zlib.adler32(chunk, checksum)
+    return f"{checksum:08x}"
+
+
+def _local_path(src):
+    parsed = urlparse(src)
+    return parsed.path if parsed.scheme == "file" else src
+
+
+class LocalCopier:
+    # Paths and file:// URLs
+    def stat(self, src):
+        stat = os.stat(_local_path(src))
+        return stat.st_size, int(stat.st_mtime)
+
+    def checksum(self, src):
+        return adler32(_local_path(src))
+
+    def copy(self, src, dst):
+        shutil.copyfile(_local_path(src), dst)
+
+
+class XRootDCopier:
+    # root:// URLs, copied with xrdcp (or TFile::Cp if xrdcp is not available)
+    def stat(self, src):
+        import ROOT
+
+        stat = ROOT.FileStat_t()
+        if ROOT.gSystem.GetPathInfo(src, stat) != 0:
+            raise OSError(f"Cannot stat {src}")
+        return stat.fSize, stat.fMtime
+
+    def checksum(self, src):
+        parsed = urlparse(src)
+        try:
+            output = subprocess.run(
+                ["xrdfs", f"{parsed.scheme}://{parsed.netloc}", "query", "checksum", parsed.path],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.split()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        # "adler32 <checksum>"
+        return output[1].zfill(8) if len(output) > 1 and output[0] == "adler32" else None
+
+    def copy(self, src, dst):
+        try:
+            subprocess.run(["xrdcp", "--silent", "--force", src, dst], check=True)
+        except FileNotFoundError:
+            import ROOT
+
+            if not ROOT.TFile.Cp(src, dst, False):
+                raise OSError(f"Cannot copy {src}")
+
+
+COPIERS = {
+    "": LocalCopier(),
+    "file": LocalCopier(),
+    "root": XRootDCopier(),
+    "xroot": XRootDCopier(),
+}
+
+
+def register_copier(scheme, copier):
+    # copier needs stat(src) -> (size, mtime) and copy(src, dst), checksum(src) is optional
+    COPIERS[scheme] = copier
+
+
+class StagingCache:
+    def __init__(self, path, max_size=100.0, workers=8, verify="size", copiers=None):
+        # max_size in GB, verify is "size" or "checksum"
+        self.path = os.path.expanduser(path)
+        self.max_size = int(max_size * 1024**3)
+        self.workers = workers
+        self.verify = verify
+        self.copiers = dict(COPIERS) if copiers is None else copiers
+        os.makedirs(self.path, exist_ok=True)
+
+    def copier(self, src):
+        scheme = urlparse(src).scheme
+        if scheme not in self.copiers:
+            raise ValueError(f"No copier registered for {src}")
+        return self.copiers[scheme]
+
+    def key(self, src):
+        return hashlib.sha256(src.encode()).hexdigest()[:32]
+
+    def stage(self, files):
+        """
+        Copy the files (in parallel) to the staging folder, if not already there and up to date.
+        Returns the paths of the local copies, in the same order.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            staged = list(pool.map(self._stage, files))
+        self.evict(keep={self.key(src) for src in files})
+        return staged
+
+    def _stage(self, src):
+        copier = self.copier(src)
+        size, mtime = copier.stat(src)
+        entry = os.path.join(self.path, self.key(src))
+        dst = os.path.join(entry, os.path.basename(urlparse(src).path))
+        meta_file = os.path.join(entry, "meta.json")
+
+        if os.path.exists(meta_file):
+            with open(meta_file, "r") as fp:
+                meta = json.load(fp)
+            if meta["size"] == size and meta["mtime"] == mtime and os.path.exists(dst) and os.path.getsize(dst) == size:
+                # LRU bookkeeping
+                os.utime(meta_file)
+                return dst
+
+        tmp = f"{entry}.tmp{os.getpid()}.{threading.get_ident()}"
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            copier.copy(src, os.path.join(tmp, os.path.basename(dst)))
+            meta = {"src": src, "size": size, "mtime": mtime, "checksum": None}
+            self._verify(copier, src, os.path.join(tmp, os.path.basename(dst)), meta)
+            with open(os.path.join(tmp, "meta.json"), "w") as fp:
+                json.dump(meta, fp, indent=4)
+            shutil.rmtree(entry, ignore_errors=True)
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                # another process staged the same file in the meantime
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return dst
+
+    def _verify(self, copier, src, dst, meta):
+        if os.path.getsize(dst) != meta["size"]:
+            raise OSError(f"Staging of {src} failed: size {os.path.getsize(dst)} != {meta['size']}")
+        if self.verify == "checksum" and hasattr(copier, "checksum"):
+            expected = copier.checksum(src)
+            if expected is not None:
+                meta["checksum"] = adler32(dst)
+                if meta["checksum"] != expected:
+                    raise OSError(f"Staging of {src} failed: checksum {meta['checksum']} != {expected}")
+
+    def entries(self):
+        entries = []
+        for key in os.listdir(self.path):
+            meta = os.path.join(self.path, key, "meta.json")
+            if not os.path.exists(meta):
+                continue
+            size = sum(
+                f.stat().st_size for f in os.scandir(os.path.join(self.path, key))
+            )
+            entries.append((os.path.getmtime(meta), size, key))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=()):
+        # Remove the least recently used copies until the staging folder fits in max_size
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key in keep:
+                continue
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+
+def default_staging_path():
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "CutFinder", "staging"
+    )
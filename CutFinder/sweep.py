@@ -0,0 +1,108 @@
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import multiprocessing
+import pickle
+
+import numpy as np
+from rich import print as pprint
+from rich.table import Table
+
+#! Sweep of the regressor penalty and fitrange on the bin-by-bin cuts already computed for every (obj, ref) pair.
+
+
+def parse_penalties(penalties):
+    return [float(p) for p in penalties.split(",")]
+
+
+def parse_fitranges(fitranges):
+    # "0:60,10:60,none" -> [(0.0, 60.0), (10.0, 60.0), None]
+    parsed = []
+    for fitrange in fitranges.split(","):
+        if fitrange.strip().lower() == "none":
+            parsed.append(None)
+        else:
+            low, high = fitrange.split(":")
+            parsed.append((float(low), float(high)))
+    return parsed
+
+
+def _fit(args):
+    regressor, cut_bins, cuts, cuts_err, fitrange, regressor_kwargs = args
+    return regressor(cut_bins, cuts, sigma=cuts_err, fitrange=fitrange, **regressor_kwargs)
+
+
+def _picklable(function):
+    try:
+        pickle.dumps(function)
+        return True
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+
+
+def sweep(glob, pairs, penalties, fitranges, ncpus=1):
+    """
+    Run glob.regressor on every (obj, ref, penalty, fitrange) combination in a process pool and evaluate the
+    rate of each fitted WP on the obj columns.
+    pairs is a list of (obj, ref_name, cut_bins, cuts, cuts_err, ref_rate).
+    Returns a dict obj.name -> list of rows (ref, penalty, fitrange, n_blocks, chi2, max_rate_dev).
+    """
+    combinations = list(itertools.product(range(len(pairs)), penalties, fitranges))
+    tasks = []
+    for pair_idx, penalty, fitrange in combinations:
+        _, _, cut_bins, cuts, cuts_err, _ = pairs[pair_idx]
+        regressor_kwargs = dict(glob.regressor_kwargs)
+        if penalty is not None:
+            regressor_kwargs["penalty"] = penalty
+        tasks.append((glob.regressor, cut_bins, cuts, cuts_err, fitrange, regressor_kwargs))
+
+    # regressors defined in the config file cannot be sent to the workers
+    if ncpus > 1 and _picklable(glob.regressor):
+        with ProcessPoolExecutor(max_workers=ncpus, mp_context=multiprocessing.get_context("spawn")) as pool:
+            fits = list(pool.map(_fit, tasks))
+    else:
+        fits = [_fit(task) for task in tasks]
+
+    # evaluate all the fitted WPs of a pair in one batch
+    rows = dict()
+    for pair_idx in range(len(pairs)):
+        obj, ref_name, _, _, _, ref_rate = pairs[pair_idx]
+        # many WPs per obj: the columns are read once (if not already), instead of an applyWP branch per WP
+        obj.bookColumns()
+        idxs = [i for i, combination in enumerate(combinations) if combination[0] == pair_idx]
+        rates, _ = obj.evaluateWP(
+            [(fits[i][0], fits[i][1]) for i in idxs], glob.pt_bins, glob.maxRate
+        )
+        ref_rate = np.asarray(ref_rate)
+        nonzero = ref_rate > 0
+        for i, rate in zip(idxs, rates):
+            _, penalty, fitrange = combinations[i]
+            edges, values, chi2 = fits[i]
+            max_rate_dev = float(np.max(np.abs(rate[nonzero] / ref_rate[nonzero] - 1.0))) if nonzero.any() else np.nan
+            rows.setdefault(obj.name, []).append(
+                {
+                    "ref": ref_name,
+                    "penalty": penalty,
+                    "fitrange": "none" if fitrange is None else f"{fitrange[0]}:{fitrange[1]}",
+                    "n_blocks": len(values),
+                    "chi2": float(chi2),
+                    "max_rate_dev": max_rate_dev,
+                }
+            )
+    return rows
+
+
+def write_table(rows, path, title=None):
+    with open(path, "w", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    table = Table(title=title)
+    for column in rows[0].keys():
+        table.add_column(column)
+    for row in rows:
+        table.add_row(
+            *[f"{value:.4g}" if isinstance(value, float) else str(value) for value in row.values()]
+        )
+    pprint(table)
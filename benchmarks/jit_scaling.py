@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+import json
+import os
+import sys
+import tempfile
+import time
+
+import typer
+from rich import print as pprint
+from rich.table import Table
+
+#! Scaling with len(pt_bins) of the per-bin selection of iterative_bin_cutter: the old graph, with new
+#! Define/Redefine/Filter strings (cuts and edges as literals) for every bin, against the compiled BinSelected kernel
+#! with the cuts as runtime data. With few events the time of each event loop is dominated by the JIT.
+#! Both run the same cut-and-veto sequence keeping half of the events in each bin.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import ROOT
+
+
+def generate(path, events):
+    rdf = (
+        ROOT.RDataFrame(events)
+        .Define("n", "(int)gRandom->Poisson(3)")
+        .Define("pt", "ROOT::RVecF v(n); for (auto &x : v) x = gRandom->Exp(15.); return v;")
+        .Define("score", "ROOT::RVecF v(n); for (auto &x : v) x = gRandom->Uniform(); return v;")
+        .Filter("n > 0")
+    )
+    rdf.Snapshot("Events", path, ["pt", "score"])
+
+
+def string_jit(rdf, pt_bins):
+    # Graph of iterative_bin_cutter before the compiled kernel
+    cuts = []
+    scores = (
+        rdf.Define("scores", f"score[pt >= {pt_bins[-1]}]")
+        .Filter("scores.size() > 0")
+        .Define("max_score", "Max(scores)")
+    ).AsNumpy(["max_score"])["max_score"]
+    cuts.append(np.quantile(scores, 0.5) if len(scores) > 0 else -np.inf)
+    if cuts[-1] != -np.inf:
+        cut_mask = f"(pt >= {pt_bins[-1]} && score >= {cuts[-1]}) || (pt < {pt_bins[-1]})"
+        rdf = (
+            rdf.Define("cut_mask", cut_mask)
+            .Redefine("score", "score[cut_mask]")
+            .Redefine("pt", "pt[cut_mask]")
+            .Filter("pt.size() > 0")
+        )
+    else:
+        rdf = rdf.Define("cut_mask", "ROOT::VecOps::RVec<bool>(pt.size(), true)")
+    for i in range(len(pt_bins) - 2, -1, -1):
+        scores = (
+            rdf.Filter(f"Max(pt) < {pt_bins[i + 1]}")
+            .Redefine("score", f"score[pt >= {pt_bins[i]} && pt < {pt_bins[i + 1]}]")
+            .Redefine("pt", f"pt[pt >= {pt_bins[i]} && pt < {pt_bins[i + 1]}]")
+            .Filter("pt.size() > 0")
+            .Define("max_score", "Max(score)")
+            .AsNumpy(["max_score"])["max_score"]
+        )
+        cuts.append(np.quantile(scores, 0.5) if len(scores) > 0 else -np.inf)
+        if cuts[-1] != -np.inf and i > 0:
+            cut_mask = f"(pt >= {pt_bins[i]} && pt < {pt_bins[i + 1]} && score >= {cuts[-1]}) || (pt < {pt_bins[i]})"
+            rdf = (
+                rdf.Redefine("cut_mask", cut_mask)
+                .Redefine("score", "score[cut_mask]")
+                .Redefine("pt", "pt[cut_mask]")
+                .Filter("pt.size() > 0")
+            )
+    return np.array(cuts[::-1])
+
+
+def compiled_kernel(rdf, pt_bins):
+    # Graph of iterative_bin_cutter with BinSelected
+    from CutFinder.library import new_cut_state, set_current_bin, set_cut
+
+    state = new_cut_state(len(pt_bins))
+    edges = "{" + ", ".join(map(str, np.asarray(pt_bins, dtype=float).tolist())) + "}"
+    rdf = (
+        rdf.Define("bin_max_score", f"BinMaxScore(pt, score, {edges})")
+        .Filter(f"BinSelected(bin_max_score, {state})")
+        .Define("max_score", f"CurrentBinScore(bin_max_score, {state})")
+    )
+    cuts = []
+    for i in range(len(pt_bins) - 1, -1, -1):
+        set_current_bin(state, i)
+        scores = rdf.AsNumpy(["max_score"])["max_score"]
+        cuts.append(np.quantile(scores, 0.5) if len(scores) > 0 else -np.inf)
+        set_cut(state, i, float(f"{cuts[-1]}"))
+    return np.array(cuts[::-1])
+
+
+def main(
+    events: int = typer.Option(10_000, "--events", help="Number of generated events."),
+    bins: str = typer.Option("5,10,20,40,80", "--bins", help="Comma separated numbers of pt bins."),
+    output: str = typer.Option("jit_scaling.json", "-o", "--output", help="JSON file with the results."),
+):
+    from CutFinder.library import load_functions
+
+    load_functions()
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events.root")
+        generate(path, events)
+        for nBins in map(int, bins.split(",")):
+            pt_bins = np.linspace(0, 100, nBins, endpoint=False)
+            row = {"pt_bins": nBins}
+            for mode, cutter in [("string_jit", string_jit), ("compiled_kernel", compiled_kernel)]:
+                rdf = ROOT.RDataFrame("Events", path)
+                start = time.perf_counter()
+                cuts = cutter(rdf, pt_bins)
+                row[mode] = time.perf_counter() - start
+                row[f"{mode}_runs"] = rdf.GetNRuns()
+                row[f"{mode}_cuts"] = cuts.tolist()
+            rows.append(row)
+
+    with open(output, "w") as fp:
+        json.dump({"events": events, "results": rows}, fp, indent=4)
+
+    table = Table(title=f"iterative_bin_cutter selection, {events} events (s)")
+    for column in ["pt bins", "string JIT", "per bin", "compiled kernel", "per bin", "same cuts"]:
+        table.add_column(column)
+    for row in rows:
+        table.add_row(
+            str(row["pt_bins"]),
+            f"{row['string_jit']:.2f}",
+            f"{row['string_jit'] / row['pt_bins']:.3f}",
+            f"{row['compiled_kernel']:.2f}",
+            f"{row['compiled_kernel'] / row['pt_bins']:.3f}",
+            str(np.allclose(row["string_jit_cuts"], row["compiled_kernel_cuts"])),
+        )
+    pprint(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from typing import Optional
+
+import typer
+from rich import print as pprint
+from rich.table import Table
+
+#! Benchmark suite on synthetic events, no access to the real samples is needed. The events are generated
+#! deterministically (every event has its own seed) in local ROOT files: Poisson multiplicity, power-law falling pt
+#! spectrum and a score that is more signal-like at high pt.
+#! Every benchmark is timed over the numbers of events, pt bins and threads, the results are written in JSON with
+#! the commit and can be compared with the ones of another commit with --compare.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import ROOT
+
+GENERATOR = """
+#include <TRandom3.h>
+#include <cmath>
+#include <utility>
+
+std::pair<ROOT::RVecF, ROOT::RVecF> SyntheticObjects(ULong64_t entry, UInt_t seed) {
+  // seed 0 would be random for TRandom3
+  TRandom3 rng(seed * 1000003ULL + entry + 1);
+  int n = rng.Poisson(4.);
+  ROOT::RVecF pt(n), score(n);
+  for (int i = 0; i < n; ++i) {
+    // dN/dpt ~ pt^-4 above 2 GeV
+    pt[i] = 2. * std::pow(1. - rng.Uniform(), -1. / 3.);
+    double u = std::pow(rng.Uniform(), 3.);
+    score[i] = rng.Uniform() < std::min(0.5, 0.05 + pt[i] / 200.) ? 1. - u : u;
+  }
+  return {pt, score};
+}
+"""
+
+MAXRATE = 31038.96
+
+
+def generate(path, events, seed):
+    # Single thread: Snapshot keeps the order of the events
+    ROOT.DisableImplicitMT()
+    rdf = (
+        ROOT.RDataFrame(events)
+        .Define("objects", f"SyntheticObjects(rdfentry_, {seed})")
+        .Define("pt", "objects.first")
+        .Define("score", "objects.second")
+    )
+    rdf.Snapshot("Events", path, ["pt", "score"])
+
+
+def make_configs(path):
+    from CutFinder.configs import ConfigObj, ConfigRef
+
+    obj = ConfigObj(samples_path=path, pt_branch="pt", score_branch="score")
+    # same sample with a loose WP, like custom_ref in configs/example_lite.py
+    ref = obj.clone(ConfigRef, WP=([0.0], [0.5]))
+    return ref, obj
+
+
+# Every benchmark gets the sample and the GlobalConf, does its setup and returns the function to time
+
+
+def bench_compute(path, glob):
+    from CutFinder.pipeline import compute_configs
+
+    ref, obj = make_configs(path)
+    return lambda: compute_configs([ref], [obj], glob)
+
+
+def bench_make_rate(path, glob):
+    from CutFinder.configs import runGraphs
+
+    ref, _ = make_configs(path)
+    ref.compute()
+    runGraphs([ref])
+    return lambda: ref.makeRate(glob.pt_bins, glob.maxRate)
+
+
+def bench_make_rate_columns(path, glob):
+    from CutFinder.configs import runGraphs
+
+    _, obj = make_configs(path)
+    obj.compute()
+    obj.bookColumns()
+    runGraphs([obj])
+    return lambda: obj.makeRate(glob.pt_bins, glob.maxRate)
+
+
+def _cutter(path, glob, columns, **kwargs):
+    from CutFinder.algorithms import iterative_bin_cutter
+    from CutFinder.configs import runGraphs
+
+    ref, obj = make_configs(path)
+    ref.compute()
+    obj.compute()
+    if columns:
+        obj.bookColumns()
+    runGraphs([ref, obj])
+    ref.makeRate(glob.pt_bins, glob.maxRate)
+    return lambda: iterative_bin_cutter(ref, obj, glob, **kwargs)
+
+
+def bench_iterative_bin_cutter(path, glob):
+    return _cutter(path, glob, columns=False)
+
+
+def bench_single_pass(path, glob):
+    return _cutter(path, glob, columns=True, single_pass=True)
+
+
+def bench_apply_wp(path, glob):
+    from CutFinder.functions import applyWP
+    from CutFinder.profiling import track
+
+    cuts = np.linspace(0.2, 0.8, len(glob.pt_bins))
+
+    def run():
+        rdf = ROOT.RDataFrame("Events", path)
+        track(rdf)
+        return applyWP("pt", "score", glob.pt_bins, cuts, rdf).Count().GetValue()
+
+    return run
+
+
+def bench_bayesian_blocks(path, glob):
+    from CutFinder.regressors import bayesian_blocks_gaussian
+
+    rng = np.random.default_rng(0)
+    x = np.asarray(glob.pt_bins, dtype=float)
+    y = np.linspace(0.2, 0.8, len(x)) + rng.normal(0.0, 0.02, len(x))
+    sigma = np.full(len(x), 0.02)
+    return lambda: bayesian_blocks_gaussian(x, y, sigma=sigma, **glob.regressor_kwargs)
+
+
+BENCHMARKS = {
+    "compute": bench_compute,
+    "makeRate": bench_make_rate,
+    "makeRate (columns)": bench_make_rate_columns,
+    "iterative_bin_cutter": bench_iterative_bin_cutter,
+    "iterative_bin_cutter (single_pass)": bench_single_pass,
+    "applyWP": bench_apply_wp,
+    "bayesian_blocks_gaussian": bench_bayesian_blocks,
+}
+
+
+def run_benchmark(benchmark, path, glob, repeat):
+    # Best of repeat, with the stats of the profiler (CPU, event loops, bytes read, JIT) of the best repetition
+    from CutFinder import profiling
+
+    profiler = profiling.enable()
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            function = benchmark(path, glob)
+            profiler.stages = dict()
+            with profiler.stage("run"):
+                function()
+        stats = profiler.stages["run"]
+        if best is None or stats["wall"] < best["wall"]:
+            best = stats
+    return best
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True, cwd=sys.path[0]
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def key(row):
+    return (row["benchmark"], row["events"], row["pt_bins"], row["threads"])
+
+
+def main(
+    events: str = typer.Option("10000,100000", "--events", help="Comma separated numbers of events."),
+    bins: str = typer.Option("10,40", "--bins", help="Comma separated numbers of pt bins."),
+    threads: str = typer.Option("1,4", "--threads", help="Comma separated numbers of threads."),
+    benchmarks: str = typer.Option(
+        ",".join(BENCHMARKS), "--benchmarks", help="Comma separated benchmarks to run."
+    ),
+    repeat: int = typer.Option(3, "--repeat", help="Repetitions, the best time is kept."),
+    seed: int = typer.Option(42, "--seed", help="Seed of the synthetic events."),
+    data_dir: Optional[str] = typer.Option(
+        None, "--data-dir", help="Folder of the generated samples, kept between runs (default: a temporary folder)."
+    ),
+    output: str = typer.Option("suite.json", "-o", "--output", help="JSON file with the results."),
+    compare: Optional[str] = typer.Option(None, "--compare", help="JSON file of a previous run to compare with."),
+):
+    from CutFinder.configs import GlobalConf
+    from CutFinder.library import load_functions
+
+    load_functions()
+    ROOT.gInterpreter.Declare(GENERATOR)
+    selected = benchmarks.split(",")
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        raise typer.BadParameter(f"Unknown benchmarks {sorted(unknown)}, available: {list(BENCHMARKS)}")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = data_dir or tmp
+        os.makedirs(folder, exist_ok=True)
+        for nEvents in map(int, events.split(",")):
+            path = os.path.join(folder, f"synthetic_{nEvents}_{seed}.root")
+            if not os.path.exists(path):
+                generate(path, nEvents, seed)
+            for nThreads in map(int, threads.split(",")):
+                ROOT.DisableImplicitMT()
+                if nThreads > 1:
+                    ROOT.EnableImplicitMT(nThreads)
+                for nBins in map(int, bins.split(",")):
+                    glob = GlobalConf(pt_bins=np.geomspace(2.0, 100.0, nBins), maxRate=MAXRATE)
+                    for name in selected:
+                        stats = run_benchmark(BENCHMARKS[name], path, glob, repeat)
+                        row = {"benchmark": name, "events": nEvents, "pt_bins": nBins, "threads": nThreads, **stats}
+                        rows.append(row)
+                        print(f"{name}: {nEvents} events, {nBins} pt bins, {nThreads} threads: {stats['wall']:.3f} s")
+
+    with open(output, "w") as fp:
+        json.dump(
+            {
+                "commit": commit(),
+                "root": ROOT.gROOT.GetVersion(),
+                "python": platform.python_version(),
+                "machine": platform.node(),
+                "seed": seed,
+                "repeat": repeat,
+                "results": rows,
+            },
+            fp,
+            indent=4,
+        )
+
+    baseline = dict()
+    if compare is not None:
+        with open(compare, "r") as fp:
+            previous = json.load(fp)
+        baseline = {key(row): row for row in previous["results"]}
+
+    title = "Synthetic benchmarks (best wall time)"
+    if compare is not None:
+        title += f", against {previous['commit']}"
+    table = Table(title=title)
+    for column in ["benchmark", "events", "pt bins", "threads", "wall [s]", "CPU [s]", "event loops", "JIT [s]"]:
+        table.add_column(column)
+    if compare is not None:
+        table.add_column("ratio")
+    for row in rows:
+        cells = [
+            row["benchmark"],
+            str(row["events"]),
+            str(row["pt_bins"]),
+            str(row["threads"]),
+            f"{row['wall']:.3f}",
+            f"{row['cpu']:.3f}",
+            str(row["event_loops"]),
+            f"{row['jit']:.3f}",
+        ]
+        if compare is not None:
+            old = baseline.get(key(row))
+            cells.append("-" if old is None else f"{row['wall'] / old['wall']:.2f}")
+        table.add_row(*cells)
+    pprint(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+import os
+import subprocess
+import sys
+import time
+
+import typer
+from rich import print as pprint
+from rich.table import Table
+
+#! Microbenchmark of the WP_mask kernel: startup cost of the compiled library against declaring the source,
+#! per-object cost of the binary search on registered edges against the old linear scan on brace-list edges.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# WP_mask before the compiled library, with the edges copied by value and scanned linearly
+LINEAR_WP_MASK = """
+RVec<bool> WP_mask_linear(const RVecF &pt, const RVecF &score,
+                          std::vector<float> pt_bins, std::vector<float> score_cuts) {
+  RVec<bool> mask(pt.size(), false);
+  for (size_t i = 0; i < pt.size(); ++i) {
+    float p = pt[i];
+    float s = score[i];
+    for (size_t j = pt_bins.size(); j-- > 0;) {
+      if (p >= pt_bins[j]) {
+        if (s >= score_cuts[j]){
+            mask[i] = true;
+        }
+        break;
+      }
+    }
+  }
+  return mask;
+}
+"""
+
+# Events generated and masked in C++, to time only the kernels
+BENCH = """
+#include <TRandom3.h>
+#include <chrono>
+
+std::vector<RVecF> bench_pt, bench_score;
+size_t bench_passing = 0;
+
+void BenchGenerate(int nEvents) {
+  TRandom3 rng(42);
+  bench_pt.clear();
+  bench_score.clear();
+  for (int e = 0; e < nEvents; ++e) {
+    int n = rng.Poisson(3);
+    RVecF pt(n), score(n);
+    for (int i = 0; i < n; ++i) {
+      pt[i] = rng.Exp(15.);
+      score[i] = rng.Uniform();
+    }
+    bench_pt.push_back(pt);
+    bench_score.push_back(score);
+  }
+}
+
+double BenchLinear(const std::vector<float> &pt_bins, const std::vector<float> &score_cuts) {
+  auto start = std::chrono::steady_clock::now();
+  for (size_t e = 0; e < bench_pt.size(); ++e)
+    bench_passing += Sum(WP_mask_linear(bench_pt[e], bench_score[e], pt_bins, score_cuts));
+  return std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+}
+
+double BenchRegistered(int wp) {
+  auto start = std::chrono::steady_clock::now();
+  for (size_t e = 0; e < bench_pt.size(); ++e)
+    bench_passing += Sum(WP_mask(bench_pt[e], bench_score[e], wp));
+  return std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+}
+"""
+
+STARTUP = {
+    "Declare": "import ROOT; ROOT.gInterpreter.Declare('#include \"{source}\"'); ROOT.WP_mask",
+    "compiled library": "from CutFinder.library import load_functions; load_functions(); import ROOT; ROOT.WP_mask",
+}
+
+
+def startup_time(statement, repeat):
+    # Best wall time of a fresh interpreter, the import of ROOT is subtracted
+    def run(code):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True, cwd=sys.path[0])
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    return run(statement) - run("import ROOT; ROOT.gInterpreter")
+
+
+def main(
+    events: int = typer.Option(1_000_000, "--events", help="Number of generated events."),
+    edges: str = typer.Option("5,20,100,1000", "--edges", help="Comma separated numbers of pt edges."),
+    repeat: int = typer.Option(3, "--repeat", help="Repetitions, the best time is kept."),
+):
+    from CutFinder.library import SOURCE, load_functions, register_wp
+
+    # warm the library cache before timing the startup
+    load_functions()
+    table = Table(title="Startup (s)")
+    table.add_column("mode")
+    table.add_column("time")
+    for mode, statement in STARTUP.items():
+        table.add_row(mode, f"{startup_time(statement.format(source=SOURCE), repeat):.3f}")
+    pprint(table)
+
+    import numpy as np
+    import ROOT
+
+    ROOT.gInterpreter.Declare(LINEAR_WP_MASK)
+    ROOT.gInterpreter.Declare(BENCH)
+    ROOT.BenchGenerate(events)
+    nObjects = sum(len(pt) for pt in ROOT.bench_pt)
+
+    table = Table(title=f"WP_mask per object (ns), {events} events, {nObjects} objects")
+    for column in ["edges", "linear", "binary search", "speedup"]:
+        table.add_column(column)
+    for nEdges in map(int, edges.split(",")):
+        pt_bins = np.linspace(0, 100, nEdges).astype(np.float32)
+        score_cuts = np.linspace(0.1, 0.9, nEdges).astype(np.float32)
+        vector_bins = ROOT.std.vector["float"](pt_bins.tolist())
+        vector_cuts = ROOT.std.vector["float"](score_cuts.tolist())
+        wp = register_wp(pt_bins, score_cuts)
+
+        linear = min(ROOT.BenchLinear(vector_bins, vector_cuts) for _ in range(repeat))
+        registered = min(ROOT.BenchRegistered(wp) for _ in range(repeat))
+        table.add_row(
+            str(nEdges),
+            f"{linear / nObjects * 1e9:.2f}",
+            f"{registered / nObjects * 1e9:.2f}",
+            f"{linear / registered:.2f}x",
+        )
+    pprint(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,30 +1,176 @@
 #ifndef FUNCTIONS_CPP
 #define FUNCTIONS_CPP
 
+#include <ROOT/RDF/RActionImpl.hxx>
+#include <ROOT/RDataFrame.hxx>
 #include <ROOT/RVec.hxx>
+#include <algorithm>
+#include <cmath>
+#include <deque>
+#include <limits>
+#include <memory>
+#include <string>
 #include <vector>
 
 using namespace ROOT;
 using namespace ROOT::VecOps;
 
 RVec<bool> WP_mask(const RVecF &pt, const RVecF &score,
-                   std::vector<float> pt_bins, std::vector<float> score_cuts) {
+                   const std::vector<float> &pt_bins,
+                   const std::vector<float> &score_cuts) {
   RVec<bool> mask(pt.size(), false);
+  const auto begin = pt_bins.begin();
+  const auto end = pt_bins.end();
   for (size_t i = 0; i < pt.size(); ++i) {
-    float p = pt[i];
+    //Assume pt_bins sorted ascendingly: the bin is the last edge <= pt (none if pt is NaN)
+    const auto bin = std::upper_bound(begin, end, pt[i]) - begin - 1;
+    mask[i] = bin >= 0 && pt[i] >= pt_bins[bin] && score[i] >= score_cuts[bin];
+  }
+  return mask;
+}
+
+// Working points registered once from Python (CutFinder.library.register_wp) and referenced by their id
+// in the Define expressions, so the edges are neither parsed nor copied for every event.
+// Register them before running the event loops
+struct WorkingPoint {
+  std::vector<float> pt_bins;
+  std::vector<float> score_cuts;
+};
+
+std::deque<WorkingPoint> &WPRegistry() {
+  static std::deque<WorkingPoint> registry;
+  return registry;
+}
+
+int RegisterWP(const std::vector<float> &pt_bins,
+               const std::vector<float> &score_cuts) {
+  WPRegistry().push_back({pt_bins, score_cuts});
+  return WPRegistry().size() - 1;
+}
+
+RVec<bool> WP_mask(const RVecF &pt, const RVecF &score, int wp) {
+  const auto &working_point = WPRegistry()[wp];
+  return WP_mask(pt, score, working_point.pt_bins, working_point.score_cuts);
+}
+
+// Runtime state of the cut-and-veto sequence of iterative_bin_cutter (CutFinder.library.new_cut_state): the cuts
+// found so far (-inf if no cut) and the pt bin being processed, set from Python between the event loops.
+// The selection is compiled once, whatever the number of pt bins
+struct CutState {
+  std::vector<double> cuts;
+  size_t current;
+};
+
+std::deque<CutState> &CutStates() {
+  static std::deque<CutState> states;
+  return states;
+}
+
+int NewCutState(size_t nBins) {
+  CutStates().push_back(
+      {std::vector<double>(nBins, -std::numeric_limits<double>::infinity()), nBins - 1});
+  return CutStates().size() - 1;
+}
+
+void SetCurrentBin(int state, size_t bin) { CutStates()[state].current = bin; }
+
+void SetCut(int state, size_t bin, double cut) { CutStates()[state].cuts[bin] = cut; }
+
+// Events with objects in the current pt bin not vetoed by the bins above (bin_max_score from BinMaxScore).
+// Going up from the current bin, the objects of a bin without cut veto the event, while the first bin with a cut
+// vetoes the event if its objects pass the cut and hides the bins above it
+bool BinSelected(const RVecF &bin_max_score, int state) {
+  const auto &cut_state = CutStates()[state];
+  if (std::isnan(bin_max_score[cut_state.current])) {
+    return false;
+  }
+  for (size_t j = cut_state.current + 1; j < cut_state.cuts.size(); ++j) {
+    const bool present = !std::isnan(bin_max_score[j]);
+    if (cut_state.cuts[j] != -std::numeric_limits<double>::infinity()) {
+      return !(present && bin_max_score[j] >= cut_state.cuts[j]);
+    }
+    if (present) {
+      return false;
+    }
+  }
+  return true;
+}
+
+float CurrentBinScore(const RVecF &bin_max_score, int state) {
+  return bin_max_score[CutStates()[state].current];
+}
+
+// Max score of the objects in each pt bin (the last bin is open ended), NaN if the bin is empty
+template <typename T, typename U>
+RVecF BinMaxScore(const RVec<T> &pt, const RVec<U> &score,
+                  const std::vector<double> &pt_bins) {
+  RVecF max_score(pt_bins.size(), std::numeric_limits<float>::quiet_NaN());
+  const auto begin = pt_bins.begin();
+  const auto end = pt_bins.end();
+  for (size_t i = 0; i < pt.size(); ++i) {
+    double p = pt[i];
     float s = score[i];
 
     //Assume pt_bins sorted ascendingly
-    for (size_t j = pt_bins.size(); j-- > 0;) {
-      if (p >= pt_bins[j]) {
-        if (s >= score_cuts[j]){
-            mask[i] = true;
-        }
-        break;
+    const auto bin = std::upper_bound(begin, end, p) - begin - 1;
+    if (bin >= 0 && p >= pt_bins[bin]) {
+      if (std::isnan(max_score[bin]) || s > max_score[bin]) {
+        max_score[bin] = s;
       }
     }
   }
-  return mask;
+  return max_score;
+}
+
+// Jagged column read in contiguous buffers (CutFinder.library.book_flat_column): the chain entry and the number of
+// objects of every event, the values of all the objects one after the other, in the order of the processing slots
+template <typename T>
+struct FlatColumn {
+  std::vector<ULong64_t> entries;
+  std::vector<ULong64_t> counts;
+  std::vector<T> values;
+};
+
+template <typename T>
+class FlatColumnHelper : public ROOT::Detail::RDF::RActionImpl<FlatColumnHelper<T>> {
+public:
+  using Result_t = FlatColumn<T>;
+
+  FlatColumnHelper(unsigned int nSlots) : fResult(std::make_shared<Result_t>()), fSlots(nSlots) {}
+  FlatColumnHelper(FlatColumnHelper &&) = default;
+  FlatColumnHelper(const FlatColumnHelper &) = delete;
+
+  std::shared_ptr<Result_t> GetResultPtr() const { return fResult; }
+  void Initialize() {}
+  void InitTask(TTreeReader *, unsigned int) {}
+
+  void Exec(unsigned int slot, ULong64_t entry, const RVec<T> &column) {
+    auto &buffer = fSlots[slot];
+    buffer.entries.push_back(entry);
+    buffer.counts.push_back(column.size());
+    buffer.values.insert(buffer.values.end(), column.begin(), column.end());
+  }
+
+  void Finalize() {
+    // one copy of every slot in the result
+    for (auto &buffer : fSlots) {
+      fResult->entries.insert(fResult->entries.end(), buffer.entries.begin(), buffer.entries.end());
+      fResult->counts.insert(fResult->counts.end(), buffer.counts.begin(), buffer.counts.end());
+      fResult->values.insert(fResult->values.end(), buffer.values.begin(), buffer.values.end());
+      buffer = Result_t();
+    }
+  }
+
+  std::string GetActionName() { return "FlatColumn"; }
+
+private:
+  std::shared_ptr<Result_t> fResult;
+  std::vector<Result_t> fSlots;
+};
+
+template <typename T>
+ROOT::RDF::RResultPtr<FlatColumn<T>> BookFlatColumn(ROOT::RDF::RNode rdf, const std::string &column) {
+  return rdf.Book<ULong64_t, RVec<T>>(FlatColumnHelper<T>(rdf.GetNSlots()), {"rdfentry_", column});
 }
 
-#endif // !FUNCTIONS_CPP
\ No newline at end of file
+#endif // !FUNCTIONS_CPP
@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+import pytest
+
+from CutFinder import staging
+from CutFinder.staging import StagingCache, register_copier
+
+#! StagingCache with a fake copier registered for the fake:// scheme: the sources are (content, mtime) in a dict and
+#! every copy is slow and counted, to check the parallel copies, the reuse of the copies and the eviction.
+
+
+class SlowCopier:
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.sources = dict()
+        self.copies = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def add(self, src, content, mtime=1_000_000):
+        self.sources[src] = (content, mtime)
+
+    def stat(self, src):
+        content, mtime = self.sources[src]
+        return len(content), mtime
+
+    def copy(self, src, dst):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with open(dst, "wb") as fp:
+            fp.write(self.sources[src][0])
+        with self.lock:
+            self.running -= 1
+            self.copies.append(src)
+
+
+@pytest.fixture
+def copier(monkeypatch):
+    # registered in a copy of the copiers, the other tests see the default ones
+    monkeypatch.setattr(staging, "COPIERS", dict(staging.COPIERS))
+    copier = SlowCopier()
+    register_copier("fake", copier)
+    return copier
+
+
+def read(path):
+    with open(path, "rb") as fp:
+        return fp.read()
+
+
+def test_stage_in_parallel(tmp_path, copier):
+    files = [f"fake://host/store/file_{i}.root" for i in range(4)]
+    for i, src in enumerate(files):
+        copier.add(src, bytes([i]) * 100)
+    cache = StagingCache(tmp_path, workers=4)
+
+    staged = cache.stage(files)
+
+    assert copier.max_running == 4
+    assert sorted(copier.copies) == files
+    # same order of the sources
+    assert [os.path.basename(path) for path in staged] == [f"file_{i}.root" for i in range(4)]
+    assert [read(path) for path in staged] == [bytes([i]) * 100 for i in range(4)]
+
+
+def test_restage_is_a_noop(tmp_path, copier):
+    files = [f"fake://host/store/file_{i}.root" for i in range(3)]
+    for src in files:
+        copier.add(src, b"x" * 100)
+    cache = StagingCache(tmp_path, workers=3)
+
+    staged = cache.stage(files)
+    copier.copies.clear()
+    start = time.perf_counter()
+
+    assert cache.stage(files) == staged
+    assert copier.copies == []
+    assert time.perf_counter() - start < copier.delay
+
+
+@pytest.mark.parametrize("change", ["size", "mtime"])
+def test_changed_source_is_copied_again(tmp_path, copier, change):
+    files = [f"fake://host/store/file_{i}.root" for i in range(2)]
+    for src in files:
+        copier.add(src, b"x" * 100)
+    cache = StagingCache(tmp_path, workers=2)
+    cache.stage(files)
+    copier.copies.clear()
+
+    if change == "size":
+        copier.add(files[0], b"y" * 120)
+    else:
+        copier.add(files[0], b"y" * 100, mtime=2_000_000)
+    staged = cache.stage(files)
+
+    assert copier.copies == [files[0]]
+    assert read(staged[0]) == copier.sources[files[0]][0]
+
+
+def test_evict_least_recently_used(tmp_path, copier):
+    a, b, c = (f"fake://host/store/file_{name}.root" for name in "abc")
+    for src in (a, b, c):
+        copier.add(src, b"x" * 1000)
+    probe = StagingCache(tmp_path / "probe")
+    probe.stage([a])
+    entry_size = probe.size()
+    # room for two copies
+    cache = StagingCache(tmp_path / "staging", max_size=2.5 * entry_size / 1024**3)
+
+    cache.stage([a])
+    cache.stage([b])
+    # b used after a, then a used again: b is the least recently used
+    os.utime(os.path.join(cache.path, cache.key(a), "meta.json"), (1000, 1000))
+    os.utime(os.path.join(cache.path, cache.key(b), "meta.json"), (2000, 2000))
+    cache.stage([a])
+    cache.stage([c])
+
+    keys = {key for _, _, key in cache.entries()}
+    assert keys == {cache.key(a), cache.key(c)}
+    assert cache.size() <= cache.max_size